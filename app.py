@@ -1,10 +1,37 @@
 import os
+import re
+import time
+import hashlib
+import uuid
+import cProfile
+import tracemalloc
 import pandas as pd
 import io
 import json
-import itertools
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
-from werkzeug.utils import secure_filename
+import numpy as np
+import openpyxl
+import multiprocessing
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from flask import (Flask, render_template, stream_template, stream_with_context, request, redirect, url_for, flash,
+                   send_file, jsonify, g, Request, Response, session)
+from markupsafe import Markup, escape
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import cached_property, secure_filename
+
+import cache
+import comparison
+import compression
+import history
+import jobs
+import metrics
+import result_store
+import storage
+import uploads
+import workbook
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # For flash messages
@@ -17,50 +44,404 @@ os.makedirs(RESULT_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['RESULT_FOLDER'] = RESULT_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 512)) * 1024 * 1024  # 512MB max upload size
+# Uploaded CSV files are hashed while the request is received and parsed from there: the files
+# of requests up to UPLOAD_MEMORY_MAX_BYTES from memory, those of larger requests from the file
+# they were received into. With KEEP_UPLOADS the raw files are also stored in the uploads
+# folder, named by their SHA-256 digest (a received file is moved there).
+app.config['UPLOAD_MEMORY_MAX_BYTES'] = int(os.environ.get('UPLOAD_MEMORY_MAX_BYTES', 32 * 1024 * 1024))
+app.config['KEEP_UPLOADS'] = os.environ.get('KEEP_UPLOADS', '1') != '0'
+
+class UploadRequest(Request):
+    """
+    Request whose uploaded files are received through uploads.upload_stream: hashed as they
+    arrive and, for requests over UPLOAD_MEMORY_MAX_BYTES, written once to a folder of the
+    request in the uploads folder (request.spool_folder).
+    """
+
+    @cached_property
+    def spool_folder(self):
+        return uploads.request_folder(app.config['UPLOAD_FOLDER'])
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return uploads.upload_stream(total_content_length, self.spool_folder, app.config['UPLOAD_MEMORY_MAX_BYTES'])
+
+app.request_class = UploadRequest
+
+# CSV files are read and classified this many rows at a time
+app.config['CSV_CHUNK_SIZE'] = int(os.environ.get('CSV_CHUNK_SIZE', 50000))
+# Rules mapping Status values and comments to the passed/failed/minor categories, optionally
+# read from a JSON file (see comparison.load_rules). Their key is part of the cache keys.
+app.config['CLASSIFICATION_RULES'] = comparison.load_rules(os.environ.get('CLASSIFICATION_RULES_FILE'))
+app.config['CLASSIFICATION_RULES_KEY'] = comparison.rules_key(app.config['CLASSIFICATION_RULES'])
+# The All_Data_* sheets copy every uploaded file into the workbook; they can be left out of
+# the default download
+app.config['INCLUDE_RAW_DATA_SHEETS'] = os.environ.get('INCLUDE_RAW_DATA_SHEETS', '1') != '0'
 
 ALLOWED_EXTENSIONS = {'csv'}
 
+# TestRail test IDs ("T1234") are linked to this URL. Stored results never contain HTML; by
+# default the browser builds the links from the raw IDs, SERVER_SIDE_LINKS=1 adds the link
+# markup to the rows served by the table API instead.
+TESTRAIL_TEST_URL = os.environ.get('TESTRAIL_TEST_URL', 'https://sonos.testrail.com/index.php?/tests/view/')
+TESTRAIL_ID_PATTERN = re.compile(r'\bT(\d+)\b')
+TESTRAIL_LINK = rf'<a href="{TESTRAIL_TEST_URL}\1" target="_blank">T\1</a>'
+app.config['SERVER_SIDE_LINKS'] = os.environ.get('SERVER_SIDE_LINKS', '0') == '1'
+
+# CSV files are parsed in this many worker processes, unless the upload is smaller than
+# PARALLEL_PARSE_MIN_BYTES in total
+app.config['PARSE_WORKERS'] = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 1))
+app.config['PARALLEL_PARSE_MIN_BYTES'] = int(os.environ.get('PARALLEL_PARSE_MIN_BYTES', 8 * 1024 * 1024))
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+# Finished comparisons (keyed by uploaded file contents and names) and parsed CSV files
+# are cached on disk; the least recently used entries are evicted beyond these sizes
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+app.config['PARSED_CACHE_MAX_BYTES'] = int(os.environ.get('PARSED_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Every route finds result files through the result cache; results are evicted by the
+# storage manager below, together with their uploaded files
+result_cache = cache.DiskLRUCache(app.config['RESULT_FOLDER'], 0)
+
+# The results and uploads folders together are kept under STORAGE_MAX_BYTES (RESULT_CACHE_MAX_BYTES
+# is the former name); comparisons unused for STORAGE_TTL_SECONDS go away with their uploaded
+# files. A background thread sweeps every STORAGE_SWEEP_SECONDS (0 only sweeps after writes).
+app.config['STORAGE_MAX_BYTES'] = int(os.environ.get('STORAGE_MAX_BYTES',
+                                                     os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024)))
+app.config['STORAGE_TTL_SECONDS'] = int(os.environ.get('STORAGE_TTL_SECONDS', 7 * 24 * 3600))
+app.config['STORAGE_SWEEP_SECONDS'] = int(os.environ.get('STORAGE_SWEEP_SECONDS', 600))
+artifact_store = storage.StorageManager(app.config['RESULT_FOLDER'], app.config['UPLOAD_FOLDER'], os.path.join(CACHE_FOLDER, 'artifacts.json'),
+                                        app.config['STORAGE_MAX_BYTES'], app.config['STORAGE_TTL_SECONDS'])
+# Files making up one stored comparison result
+RESULT_SUFFIXES = ['.json', '.arrow']
+# Case index stored next to a result so runs can be added to it (results stored before it lack it)
+CASES_SUFFIX = '.cases.arrow'
+# Locks of result workbooks being generated, shared by workbook paths with the same hash so
+# their number stays fixed however many results are served
+_workbook_locks = [threading.Lock() for _ in range(64)]
+
+# Bumped whenever the structure of cached parsed runs changes
+PARSED_FORMAT_VERSION = 4
+parsed_cache = cache.DiskLRUCache(os.path.join(CACHE_FOLDER, 'parsed'), app.config['PARSED_CACHE_MAX_BYTES'])
+
+# Maximum number of comparisons processed at the same time
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+jobs.configure(app.config['JOB_WORKERS'])
+
+# Stage timings are served at /metrics and in Server-Timing headers. METRICS_TRACE_MEMORY=1
+# also records the peak memory of every stage (tracemalloc slows processing down noticeably)
+app.config['METRICS_TRACE_MEMORY'] = os.environ.get('METRICS_TRACE_MEMORY', '0') == '1'
+if app.config['METRICS_TRACE_MEMORY'] and not tracemalloc.is_tracing():
+    tracemalloc.start()
+# With PROFILE_REQUESTS=1, requests with ?profile=1 are profiled with cProfile. Request profiles
+# go to results/profiles; a comparison started by a profiled upload saves "<result>.prof" next to it
+app.config['PROFILE_REQUESTS'] = os.environ.get('PROFILE_REQUESTS', '0') == '1'
+PROFILE_FOLDER = os.path.join(RESULT_FOLDER, 'profiles')
+
+# Text responses (HTML, JSON, metrics) of at least COMPRESS_MIN_BYTES are compressed with brotli
+# (when installed) or gzip, as the client accepts. Result pages are also kept precompressed next
+# to the result ("<result>.results.html.gz"), so repeat views only read a file.
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1') != '0'
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+# Result pages are stored compressed next to their result and sent from there on later views
+app.config['STORE_RESULT_PAGES'] = os.environ.get('STORE_RESULT_PAGES', '1') != '0'
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+
+# Every classified run is stored once in this SQLite database, for the history endpoints
+# (/api/history/...) and to compare stored runs without uploading them again.
+# HISTORY_DB= (empty) turns the history off.
+app.config['HISTORY_DB'] = os.environ.get(
+    'HISTORY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history', 'runs.sqlite'))
+
 def create_hyperlink_for_ids(df, id_col="ID", additional_id_cols=None):
     """
     Create a copy of the dataframe with ID hyperlinks for web display.
-    Does not modify the original dataframe.
+    Does not modify the original dataframe; untouched columns are shared, not copied.
 
     Parameters:
     - df: DataFrame to process
     - id_col: Primary ID column name
     - additional_id_cols: Additional ID columns to process (e.g., for merged dataframes)
     """
-    import re
-    df_copy = df.copy()
-
-    # Process the main ID column
-    if id_col in df_copy.columns:
-        df_copy[id_col] = df_copy[id_col].astype(str).apply(
-            lambda x: re.sub(
-                r'\bT(\d+)\b',
-                r'<a href="https://sonos.testrail.com/index.php?/tests/view/\1" target="_blank">T\1</a>',
-                x
-            )
-        )
-
-    # Process any additional ID columns
-    if additional_id_cols:
-        for col in additional_id_cols:
-            if col in df_copy.columns:
-                df_copy[col] = df_copy[col].astype(str).apply(
-                    lambda x: re.sub(
-                        r'\bT(\d+)\b',
-                        r'<a href="https://sonos.testrail.com/index.php?/tests/view/\1" target="_blank">T\1</a>',
-                        x
-                    )
-                )
+    id_cols = [col for col in [id_col] + list(additional_id_cols or []) if col in df.columns]
+    if not id_cols:
+        return df
+
+    df_copy = df.copy(deep=False)
+    for col in id_cols:
+        df_copy[col] = df[col].astype(str).str.replace(TESTRAIL_ID_PATTERN, TESTRAIL_LINK, regex=True)
 
     return df_copy
 
+def link_id_cells(values):
+    """
+    Add TestRail links to the IDs of table API rows. Returns the values and, per value,
+    whether it is now HTML: linked values have the rest of their text escaped, the others
+    are returned unchanged and must be shown as text.
+    """
+    linked_values = []
+    flags = []
+    for value in values:
+        text = '' if value is None else str(value)
+        linked = TESTRAIL_ID_PATTERN.search(text) is not None
+        linked_values.append(TESTRAIL_ID_PATTERN.sub(TESTRAIL_LINK, str(escape(text))) if linked else value)
+        flags.append(linked)
+    return linked_values, flags
+
+@app.before_request
+def start_storage_sweeper():
+    # Started by the first request, so parse worker processes importing this module never sweep
+    artifact_store.start_sweeper(app.config['STORAGE_SWEEP_SECONDS'],
+                                 on_error=lambda e: app.logger.warning("Storage sweep failed: %s", e))
+
+@app.teardown_request
+def discard_request_uploads(exception=None):
+    # Files the request received to disk and did not hand to a job (failed checks, cached results)
+    spool_folder = request.__dict__.get('spool_folder')
+    if spool_folder and not g.get('spool_folder_in_use'):
+        uploads.discard_request_folder(spool_folder)
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_start = time.perf_counter()
+    if profiling_requested():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        profile_name = f"{time.strftime('%Y%m%d-%H%M%S')}_{request.endpoint}_{uuid.uuid4().hex[:8]}.prof"
+        profiler.dump_stats(os.path.join(PROFILE_FOLDER, profile_name))
+
+    if request.endpoint not in ('static', 'metrics_endpoint') and 'request_start' in g:
+        header = metrics.server_timing_header(time.perf_counter() - g.request_start)
+        if header:
+            response.headers['Server-Timing'] = header
+    return response
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress text responses with the best coding the client accepts. Files sent as is
+    (downloads) and responses that are already compressed are left alone.
+    """
+    if (not app.config['COMPRESS_RESPONSES'] or response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = compression.choose_encoding(request.accept_encodings)
+    data = response.get_data()
+    if encoding is None or len(data) < app.config['COMPRESS_MIN_BYTES']:
+        return response
+
+    response.set_data(compression.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def file_etag(paths, *parts):
+    """
+    Validator of a response built only from the given result files (and the extra parts,
+    e.g. the query string). Result files are never changed in place, only replaced with
+    os.replace, which gives them a new inode; their modification time is not used, as the
+    result cache refreshes it on every hit.
+    """
+    key = [f"{stat.st_ino}:{stat.st_size}" for stat in map(os.stat, paths)] + [str(part) for part in parts]
+    return hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:20]
+
+def template_version(template_name):
+    # Part of the validators of rendered pages, so a changed template is picked up
+    return os.stat(os.path.join(app.root_path, app.template_folder, template_name)).st_mtime_ns
+
+def not_modified(etag, last_modified):
+    """
+    Return a 304 response when the client's copy (If-None-Match / If-Modified-Since) is
+    current, or None when the response has to be built.
+    """
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=datetime.fromtimestamp(last_modified, timezone.utc)):
+        return None
+    response = Response(status=304)
+    return with_validators(response, etag, last_modified)
+
+def with_validators(response, etag, last_modified):
+    # Weak ETags: the same page is sent with different content codings
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # Revalidate on every use, so a replaced result is never served stale
+    response.cache_control.no_cache = True
+    return response
+
+def result_page_response(result_stem, page, etag, render):
+    """
+    Send a rendered result page from its precompressed copies next to the result
+    ("<result>.<page>.<etag>.html.gz", and ".br" with brotli). When there are no copies for
+    this version of the page yet, the page is streamed (see page_response) and the copies are
+    stored once it was sent completely.
+
+    Parameters:
+    - result_stem: Name of the result the page shows
+    - page: Kind of page, e.g. "results"
+    - etag: Validator of the page (see file_etag); copies of other versions are left to eviction
+    - render: Function returning the page HTML as segments (see stream_page)
+    """
+    if not app.config['STORE_RESULT_PAGES']:
+        return page_response(render())
+
+    page_stem = f"{result_stem}.{page}.{etag}"
+    copies = {encoding: result_cache.path(f"{page_stem}.html{compression.SUFFIXES[encoding]}")
+              for encoding in compression.ENCODINGS}
+
+    if not all(os.path.exists(path) for path in copies.values()):
+        temp_copies = {name: (result_cache.temp_path(f"{page_stem}.html{compression.SUFFIXES[name]}"), path)
+                       for name, path in copies.items()}
+        return page_response(render(), temp_copies, on_stored=lambda: artifact_store.sweep(keep={result_stem}))
+
+    encoding = compression.choose_encoding(request.accept_encodings) if app.config['COMPRESS_RESPONSES'] else None
+    result_cache.touch(page_stem + '.html', list(compression.SUFFIXES.values()))
+    with open(copies[encoding or 'gzip'], 'rb') as f:
+        body = f.read()
+    if encoding is None:
+        body = compression.decompress(body, 'gzip')
+
+    response = Response(body, mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def page_response(segments, copies=None, on_stored=None):
+    """
+    Stream an HTML page segment by segment, compressed with the best coding the client
+    accepts; every segment is flushed to the client as soon as it is ready. Only the
+    segment being sent is held in memory.
+
+    Parameters:
+    - segments: Iterable of HTML strings (see stream_page)
+    - copies: Optional {coding: (temporary path, path)}; the page is written compressed in
+      each coding to its temporary file as it is sent, and moved to the path once it was
+      sent completely (the temporary files are removed when the client goes away first)
+    - on_stored: Optional callback called once the copies are in place
+    """
+    copies = copies or {}
+    encoding = compression.choose_encoding(request.accept_encodings) if app.config['COMPRESS_RESPONSES'] else None
+    # The fast level, as the page is compressed while the client waits for it
+    compressors = {name: compression.StreamCompressor(name)
+                   for name in set(copies) | ({encoding} if encoding else set())}
+
+    def generate():
+        files = {name: open(temp_path, 'wb') for name, (temp_path, _) in copies.items()}
+        complete = False
+        try:
+            for segment in segments:
+                data = segment.encode('utf-8')
+                if not data:
+                    continue
+                compressed = {name: compressor.compress(data) for name, compressor in compressors.items()}
+                for name, f in files.items():
+                    f.write(compressed[name])
+                yield compressed[encoding] if encoding else data
+            compressed = {name: compressor.finish() for name, compressor in compressors.items()}
+            for name, f in files.items():
+                f.write(compressed[name])
+            complete = True
+            if encoding:
+                yield compressed[encoding]
+        finally:
+            for f in files.values():
+                f.close()
+            for temp_path, path in copies.values():
+                if complete:
+                    os.replace(temp_path, path)
+                elif os.path.exists(temp_path):
+                    os.remove(temp_path)
+        if copies and on_stored:
+            on_stored()
+
+    response = Response(stream_with_context(generate()), mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Marks where stream_page inserts a table into the page; see table_placeholder
+TABLE_PLACEHOLDER = re.compile(r'<!--stream-table:(\d+)-->')
+
+def table_placeholder(index):
+    """
+    Stand-in for a table in template data, replaced by tables[index]() of stream_page.
+    """
+    return Markup(f'<!--stream-table:{index}-->')
+
+def stream_page(template_name, tables=(), resources=(), **context):
+    """
+    Render a template as a stream of segments: the page up to the first table placeholder
+    (summary and matrix included), then each table, built only when the page reaches it,
+    then the page up to the next placeholder, and so on. The beginning of the page does not
+    wait for the tables, and only one table is held in memory at a time.
+
+    Parameters:
+    - template_name: Template to render
+    - tables: Functions returning the HTML of each table (see table_placeholder)
+    - resources: Objects closed once the page is rendered (e.g. the workbook the tables come from)
+    - context: Template variables
+    """
+    try:
+        pending = []
+        for piece in stream_template(template_name, **context):
+            parts = TABLE_PLACEHOLDER.split(piece)
+            pending.append(parts[0])
+            for index, text in zip(parts[1::2], parts[2::2]):
+                yield ''.join(pending)
+                with metrics.stage("render"):
+                    html = tables[int(index)]()
+                yield html
+                pending = [text]
+        yield ''.join(pending)
+    finally:
+        for resource in resources:
+            resource.close()
+
+def profiling_requested():
+    return app.config['PROFILE_REQUESTS'] and request.values.get('profile') == '1'
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    """
+    Call func, profiling it with cProfile into profile_path when a path is given.
+    """
+    if profile_path is None:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Stage timings, peak memory and input sizes in the Prometheus text format.
+    """
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def store_upload(upload):
+    """
+    Store the raw file of an upload when KEEP_UPLOADS is set (see uploads.keep_upload).
+    Returns the path recorded as its source in the result and the run history: the stored
+    file, or None when the raw file is not kept.
+    """
+    if app.config['KEEP_UPLOADS']:
+        return uploads.keep_upload(upload, app.config['UPLOAD_FOLDER'])
+    return None
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -93,32 +474,372 @@ def index():
             flash('Only CSV files are allowed', 'warning')
             return redirect(request.url)
 
-        # Save files
-        file_paths = []
-        for i, file in enumerate(files):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
-            file.save(filepath)
-            file_paths.append(filepath)
+        # The files were hashed while they were received; nothing else is written for cached results
+        spool_folder = request.spool_folder
+        with metrics.stage("upload"):
+            uploaded = [uploads.read_upload(file.stream, file.filename, spool_folder,
+                                            app.config['UPLOAD_MEMORY_MAX_BYTES']) for file in files]
+
+        # Identical uploads with the same names map to the same cached result
+        file_digests = [upload["digest"] for upload in uploaded]
+        job_id = cache.result_key(file_digests, file_names, app.config['CLASSIFICATION_RULES_KEY'])
+        result_stem = f'multi_case_comparison_result_{job_id}'
+
+        if result_cache.lookup(result_stem, RESULT_SUFFIXES):
+            return redirect(url_for('results', filename=result_stem + '.xlsx', json_file=result_stem + '.json'))
+
+        # The same comparison is already queued; its job has the files
+        if jobs.is_active(job_id):
+            return redirect(url_for('job_progress', job_id=job_id))
+
+        # Queue the comparison; every job writes to its own output file
+        file_paths = [store_upload(upload) for upload in uploaded]
+        g.spool_folder_in_use = True
+        artifact_store.register(result_stem, file_paths)
+        output_path = result_cache.path(result_stem + '.xlsx')
+        profile_path = result_cache.path(result_stem + '.prof') if profiling_requested() else None
+        jobs.submit_job(run_comparison_job, file_paths, file_names, output_path, file_digests, job_id=job_id,
+                        profile_path=profile_path, sources=[uploads.upload_source(upload) for upload in uploaded],
+                        spool_folder=spool_folder)
+
+        return redirect(url_for('job_progress', job_id=job_id))
+
+    stored_runs = history.list_runs(app.config['HISTORY_DB'], 50) if app.config['HISTORY_DB'] else []
+    return render_template('index.html', stored_runs=stored_runs)
+
+@app.route('/results/<filename>/add-run', methods=['POST'])
+def add_run(filename):
+    """
+    Add one more CSV file to a stored comparison. Only the new file is parsed; the
+    extended comparison is stored as a new result.
+    """
+    stem = os.path.splitext(filename)[0]
+    results_url = url_for('results', filename=filename, json_file=stem + '.json')
 
-        try:
-            # Process the files and get both Excel file and comparison data
-            result_file, comparison_data = process_csv_files(file_paths, file_names)
+    if secure_filename(filename) != filename or not result_cache.lookup(stem, RESULT_SUFFIXES):
+        flash('Error: Result data not found. Please upload files again.', 'danger')
+        return redirect(url_for('index'))
 
-            # Save comparison data to a temporary JSON file
-            json_filename = os.path.basename(result_file).replace('.xlsx', '.json')
-            json_filepath = os.path.join(app.config['RESULT_FOLDER'], json_filename)
+    file = request.files.get('file')
+    file_name = request.form.get('file_name', '').strip()
 
-            with open(json_filepath, 'w') as f:
-                json.dump(comparison_data, f)
+    if file is None or file.filename == '':
+        flash('A CSV file is required', 'warning')
+        return redirect(results_url)
 
-            # Return results page
-            return redirect(url_for('results', filename=os.path.basename(result_file),
-                                    json_file=json_filename))
-        except Exception as e:
-            flash(f'Error processing files: {str(e)}', 'danger')
-            return redirect(request.url)
+    if not file_name:
+        flash('A name for the new file is required', 'warning')
+        return redirect(results_url)
+
+    if not allowed_file(file.filename):
+        flash('Only CSV files are allowed', 'warning')
+        return redirect(results_url)
+
+    json_filepath = result_cache.path(stem + '.json')
+    manifest = load_result_manifest(json_filepath, os.path.getmtime(json_filepath))
+    try:
+        comparison.check_extendable(manifest, file_name, app.config['CLASSIFICATION_RULES_KEY'])
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(results_url)
+
+    spool_folder = request.spool_folder
+    with metrics.stage("upload"):
+        upload = uploads.read_upload(file.stream, file.filename, spool_folder, app.config['UPLOAD_MEMORY_MAX_BYTES'])
+
+    # Same key as a full comparison of the same files, so either way hits the cache
+    file_digest = upload["digest"]
+    job_id = cache.result_key(manifest['file_digests'] + [file_digest], manifest['file_names'] + [file_name],
+                              app.config['CLASSIFICATION_RULES_KEY'])
+    result_stem = f'multi_case_comparison_result_{job_id}'
+
+    if result_cache.lookup(result_stem, RESULT_SUFFIXES):
+        return redirect(url_for('results', filename=result_stem + '.xlsx', json_file=result_stem + '.json'))
+
+    if jobs.is_active(job_id):
+        return redirect(url_for('job_progress', job_id=job_id))
+
+    filepath = store_upload(upload)
+    g.spool_folder_in_use = True
+    artifact_store.register(result_stem, [path for path in manifest['source_files'] + [filepath] if path])
+    output_path = result_cache.path(result_stem + '.xlsx')
+    profile_path = result_cache.path(result_stem + '.prof') if profiling_requested() else None
+    jobs.submit_job(run_add_run_job, stem, filepath, file_name, output_path, file_digest, job_id=job_id,
+                    profile_path=profile_path, source=uploads.upload_source(upload), spool_folder=spool_folder)
+
+    return redirect(url_for('job_progress', job_id=job_id))
+
+@app.route('/history/compare', methods=['POST'])
+def compare_stored_runs():
+    """
+    Compare runs of the history store by ID, without uploading and parsing their CSV files again.
+    Runs are compared in the order they were stored.
+    """
+    if not app.config['HISTORY_DB']:
+        flash('The run history is turned off', 'warning')
+        return redirect(url_for('index'))
+
+    try:
+        run_ids = sorted({int(run_id) for run_id in request.form.getlist('run_ids')})
+    except ValueError:
+        flash('Invalid run ID', 'warning')
+        return redirect(url_for('index'))
+
+    if len(run_ids) < 2:
+        flash('Select at least two stored runs to compare', 'warning')
+        return redirect(url_for('index'))
+
+    try:
+        stored = history.get_runs(app.config['HISTORY_DB'], run_ids)
+    except KeyError as e:
+        flash(str(e.args[0]), 'warning')
+        return redirect(url_for('index'))
+
+    if any(run['rules'] != app.config['CLASSIFICATION_RULES_KEY'] for run in stored):
+        flash('Some of these runs were classified with other rules; upload them again instead', 'warning')
+        return redirect(url_for('index'))
+
+    # Runs stored under the same name are told apart by their ID
+    names = [run['name'] for run in stored]
+    file_names = [f"{name}_{run['id']}" if names.count(name) > 1 else name for name, run in zip(names, stored)]
+
+    # Same key as uploading the same files under these names
+    job_id = cache.result_key([run['file_digest'] for run in stored], file_names,
+                              app.config['CLASSIFICATION_RULES_KEY'])
+    result_stem = f'multi_case_comparison_result_{job_id}'
+
+    if result_cache.lookup(result_stem, RESULT_SUFFIXES):
+        return redirect(url_for('results', filename=result_stem + '.xlsx', json_file=result_stem + '.json'))
+
+    artifact_store.register(result_stem, [run['source_file'] for run in stored if run['source_file']])
+    output_path = result_cache.path(result_stem + '.xlsx')
+    profile_path = result_cache.path(result_stem + '.prof') if profiling_requested() else None
+    jobs.submit_job(run_history_comparison_job, run_ids, file_names, output_path, job_id=job_id,
+                    profile_path=profile_path)
+
+    return redirect(url_for('job_progress', job_id=job_id))
+
+@app.route('/api/history/runs')
+def history_runs_api():
+    """
+    Stored runs, most recent first (?limit=, default 100).
+    """
+    if not app.config['HISTORY_DB']:
+        return jsonify({"error": "The run history is turned off"}), 404
+    with metrics.stage("history"):
+        runs = history.list_runs(app.config['HISTORY_DB'], request.args.get('limit', 100, type=int))
+    return jsonify({"runs": runs})
+
+@app.route('/api/history/cases/<path:case_id>')
+def case_history_api(case_id):
+    """
+    Results of one case over the last stored runs (?runs=, default 60; optional ?plan=).
+    """
+    if not app.config['HISTORY_DB']:
+        return jsonify({"error": "The run history is turned off"}), 404
+    with metrics.stage("history"):
+        response = history.case_history(app.config['HISTORY_DB'], case_id, request.args.get('runs', 60, type=int),
+                                        request.args.get('plan') or None)
+    return jsonify(response)
+
+@app.route('/api/history/flaky')
+def flaky_cases_api():
+    """
+    Cases flipping most often between passed and failed over the last stored runs
+    (?runs=, default 60; ?limit=, default 50; optional ?plan=).
+    """
+    if not app.config['HISTORY_DB']:
+        return jsonify({"error": "The run history is turned off"}), 404
+    with metrics.stage("history"):
+        cases = history.flaky_cases(app.config['HISTORY_DB'], request.args.get('runs', 60, type=int),
+                                    request.args.get('limit', 50, type=int), request.args.get('plan') or None)
+    return jsonify({"cases": cases})
+
+def run_comparison_job(file_paths, file_names, output_path, file_digests=None, progress=None, profile_path=None,
+                       sources=None, spool_folder=None):
+    """
+    Run a full comparison in the background and store its result.
+    Returns the names needed to build the results URL.
+
+    Parameters:
+    - file_paths: List of paths to the CSV files
+    - file_names: List of names for the CSV files
+    - output_path: Path of the Excel file of this result
+    - file_digests: Optional SHA-256 digests of the CSV files, used for the parsed data cache
+    - progress: Optional callback(stage, percent)
+    - profile_path: Optional path to save a cProfile capture of the job to
+    - sources: Optional CSV sources to parse instead of file_paths (see uploads.upload_source)
+    - spool_folder: Optional request folder of the uploads, removed when the job ends
+    """
+    try:
+        comparison_data = run_profiled(profile_path, process_csv_files, file_paths, file_names, progress,
+                                       file_digests=file_digests, sources=sources)
+        return store_comparison_result(output_path, comparison_data, progress)
+    except Exception:
+        unregister_failed_result(output_path)
+        raise
+    finally:
+        uploads.discard_request_folder(spool_folder)
+
+def run_add_run_job(result_stem, file_path, file_name, output_path, file_digest=None, progress=None,
+                    profile_path=None, source=None, spool_folder=None):
+    """
+    Add one CSV file to a stored comparison in the background and store the extended result
+    as a new entry (the original result stays available).
+
+    Parameters:
+    - result_stem: Name of the stored comparison to extend (JSON file name without extension)
+    - file_path: Path to the new CSV file
+    - file_name: Name of the new file
+    - output_path: Path of the Excel file of the extended result
+    - file_digest: Optional SHA-256 digest of the new file
+    - progress: Optional callback(stage, percent)
+    - profile_path: Optional path to save a cProfile capture of the job to
+    - source: Optional CSV source to parse instead of file_path (see uploads.upload_source)
+    - spool_folder: Optional request folder of the upload, removed when the job ends
+    """
+    try:
+        json_filepath = result_cache.path(result_stem + '.json')
+        manifest = load_result_manifest(json_filepath, os.path.getmtime(json_filepath))
+        comparison_data = run_profiled(profile_path, add_run_to_comparison, manifest,
+                                       result_cache.path(result_stem + '.arrow'), file_path, file_name,
+                                       file_digest, progress, source=source,
+                                       cases_path=result_cache.path(result_stem + CASES_SUFFIX))
+        return store_comparison_result(output_path, comparison_data, progress)
+    except Exception:
+        unregister_failed_result(output_path)
+        raise
+    finally:
+        uploads.discard_request_folder(spool_folder)
+
+def run_history_comparison_job(run_ids, file_names, output_path, progress=None, profile_path=None):
+    """
+    Compare runs of the history store in the background and store the result.
+
+    Parameters:
+    - run_ids: IDs of the stored runs, in comparison order
+    - file_names: Names of the runs in the comparison
+    - output_path: Path of the Excel file of this result
+    - progress: Optional callback(stage, percent)
+    - profile_path: Optional path to save a cProfile capture of the job to
+    """
+    try:
+        comparison_data = run_profiled(profile_path, compare_history_runs, run_ids, file_names, progress)
+        return store_comparison_result(output_path, comparison_data, progress)
+    except Exception:
+        unregister_failed_result(output_path)
+        raise
+
+def unregister_failed_result(output_path):
+    """
+    Drop the storage registration of a result whose job failed, so its uploads are not kept
+    for an in-progress comparison that will never be stored (see StorageManager.unregister).
+    """
+    artifact_store.unregister(os.path.splitext(os.path.basename(output_path))[0])
+
+def store_comparison_result(output_path, comparison_data, progress=None):
+    """
+    Store comparison data next to output_path and return the names needed to build the results URL.
+
+    The files are written under a temporary name first, so a result only becomes visible
+    to the cache once it is complete. The Excel file itself is only built on first download.
+    """
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+    json_filepath = os.path.join(os.path.dirname(output_path), stem + '.json')
+    tables_path = os.path.join(os.path.dirname(output_path), stem + '.arrow')
+    temp_json_filepath = result_cache.temp_path(stem + '.json')
+    temp_tables_path = result_cache.temp_path(stem + '.arrow')
+    cases_path = os.path.join(os.path.dirname(output_path), stem + CASES_SUFFIX)
+    temp_cases_path = result_cache.temp_path(stem + CASES_SUFFIX)
+
+    # Save the manifest (JSON), the tables (Arrow) and the case index for adding runs (Arrow)
+    if progress:
+        progress("json", 50)
+    with metrics.stage("store"):
+        result_store.write_result(temp_json_filepath, temp_tables_path, comparison_data, temp_cases_path)
+    if os.path.exists(temp_cases_path):
+        os.replace(temp_cases_path, cases_path)
+    os.replace(temp_tables_path, tables_path)
+    os.replace(temp_json_filepath, json_filepath)
+
+    artifact_store.sweep(keep={stem})
+
+    return {"filename": os.path.basename(output_path), "json_file": os.path.basename(json_filepath)}
+
+def load_run_cached(file_path, file_digest=None):
+    """
+    Read and classify a CSV file, reusing the result for an identical file seen before.
+
+    Parameters:
+    - file_path: Path to the CSV file, or its contents as bytes
+    - file_digest: Optional SHA-256 digest of the file (computed if not given)
+    """
+    file_digest = file_digest or cache.source_digest(file_path)
+    stem = f"{file_digest}_v{PARSED_FORMAT_VERSION}_{app.config['CLASSIFICATION_RULES_KEY']}"
+    cached_path = parsed_cache.path(stem + '.pkl')
 
-    return render_template('index.html')
+    if parsed_cache.lookup(stem, ['.pkl']):
+        try:
+            return pd.read_pickle(cached_path)
+        except Exception:
+            # Unreadable entry (e.g. evicted while reading), parse the CSV again
+            pass
+
+    run = comparison.read_classified_csv(file_path, app.config['CSV_CHUNK_SIZE'],
+                                         app.config['CLASSIFICATION_RULES'])
+    # Jobs and parse workers may parse the same file at once: whoever stores it first wins,
+    # and the others keep the stored entry
+    if not os.path.exists(cached_path):
+        temp_path = parsed_cache.temp_path(stem + '.pkl')
+        try:
+            pd.to_pickle(run, temp_path)
+            os.replace(temp_path, cached_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if not os.path.exists(cached_path):
+                raise
+        parsed_cache.evict(keep={stem})
+    return run
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Report the current stage and percent complete of a comparison job.
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    response = {
+        "id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "percent": job["percent"],
+        "stages": jobs.JOB_STAGES
+    }
+    if job["status"] == "done":
+        response["results_url"] = url_for('results', filename=job["result"]["filename"],
+                                          json_file=job["result"]["json_file"])
+    elif job["status"] == "failed":
+        response["error"] = f'Error processing files: {job["error"]}'
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>/progress')
+def job_progress(job_id):
+    """
+    Progress page that polls the job status and redirects to the results once done.
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        flash('Error: Comparison job not found. Please upload files again.', 'danger')
+        return redirect(url_for('index'))
+
+    if job["status"] == "done":
+        return redirect(url_for('results', filename=job["result"]["filename"],
+                                json_file=job["result"]["json_file"]))
+
+    return render_template('job.html', job_id=job_id, stages=jobs.JOB_STAGES)
 
 @app.route('/results/<filename>')
 def results(filename):
@@ -129,44 +850,49 @@ def results(filename):
         flash('Error: Missing JSON data. Please upload files again.', 'danger')
         return redirect(url_for('index'))
 
-    json_filepath = os.path.join(app.config['RESULT_FOLDER'], json_file)
+    json_filepath = result_cache.path(json_file)
 
     # Check if the JSON file exists
     if not os.path.exists(json_filepath):
         flash('Error: Result data not found. Please upload files again.', 'danger')
         return redirect(url_for('index'))
+    artifact_store.touch(os.path.splitext(json_file)[0])
 
-    # Load comparison data from JSON file
-    try:
-        with open(json_filepath, 'r') as f:
-            comparison_data = json.load(f)
+    # The page only depends on the manifest and the template, unless messages are pending
+    last_modified = max(os.path.getmtime(json_filepath), template_version('results.html') / 1e9)
+    etag = file_etag([json_filepath], template_version('results.html'), filename, json_file)
+    cacheable = not session.get('_flashes')
+    if cacheable and (response := not_modified(etag, last_modified)) is not None:
+        return response
+
+    # Load the result manifest; tables are fetched page by page from the API
+    def render():
+        with metrics.stage("manifest"):
+            manifest = load_result_manifest(json_filepath, os.path.getmtime(json_filepath))
 
-        # Convert string representations of DataFrames back to DataFrames for display
         data_for_display = {}
-        for key, value in comparison_data.items():
+        for key, value in manifest.items():
             if key == 'summary' or key == 'file_names' or key == 'file_count' or key == 'matrix':
                 data_for_display[key] = value
-            else:
-                if isinstance(value, str):  # Check if it's a string (JSON serialized DataFrame)
-                    df = pd.read_json(value)
-                    # Convert DataFrame to HTML table
-                    data_for_display[key] = df.to_html(classes='table table-striped table-bordered table-hover',
-                                                    index=False, escape=False)
-                else:
-                    # Handle nested structures (like dictionaries of DataFrames)
-                    nested_data = {}
-                    for nested_key, nested_value in value.items():
-                        if isinstance(nested_value, str):
-                            nested_df = pd.read_json(nested_value)
-                            nested_data[nested_key] = nested_df.to_html(
-                                classes='table table-striped table-bordered table-hover',
-                                index=False, escape=False
-                            )
-                        else:
-                            nested_data[nested_key] = nested_value
-                    data_for_display[key] = nested_data
-
-        return render_template('results.html', filename=filename, data=data_for_display)
+        for section, tables in manifest.get('tables', {}).items():
+            data_for_display[section] = {name: None for name in tables}
+        data_for_display['testrail_url'] = TESTRAIL_TEST_URL
+        data_for_display['api_base'] = url_for('result_table_api', result_id=os.path.splitext(json_file)[0],
+                                               table='')
+
+        # Tables are loaded by the page from the table API, so the page has no table placeholders
+        return stream_page('results.html', filename=filename, data=data_for_display)
+
+    try:
+        stem = os.path.splitext(json_file)[0]
+        if not cacheable:
+            # Rendered before responding, so the session cookie drops the messages shown
+            return ''.join(render())
+        if secure_filename(json_file) == json_file and filename == stem + '.xlsx':
+            response = result_page_response(stem, 'results', etag, render)
+        else:
+            response = page_response(render())
+        return with_validators(response, etag, last_modified)
     except json.JSONDecodeError:
         flash('Error: Failed to decode JSON data. Please upload files again.', 'danger')
         return redirect(url_for('index'))
@@ -174,9 +900,190 @@ def results(filename):
         flash(f'Error processing results: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
+@lru_cache(maxsize=32)
+def load_result_manifest(json_filepath, mtime):
+    """
+    Load the manifest of a stored comparison. Cached per file path and modification time.
+    """
+    return result_store.read_manifest(json_filepath)
+
+@lru_cache(maxsize=64)
+def load_result_table(json_filepath, mtime, section, name):
+    """
+    Load one table of a stored comparison as a DataFrame, without reading the other tables.
+    Cached per file path and modification time, so paging through a table reads it once.
+
+    Parameters:
+    - json_filepath: Path to the comparison manifest
+    - mtime: Modification time of the manifest (part of the cache key)
+    - section: Top level key, e.g. "failed_comparisons" or "all_data"
+    - name: Table name within the section, e.g. "A_only" or "all_failed_A"
+    """
+    manifest = load_result_manifest(json_filepath, mtime)
+    table = manifest.get('tables', {}).get(section, {}).get(name)
+    if table is None:
+        raise KeyError(f"{section}/{name}")
+    return result_store.read_table(os.path.splitext(json_filepath)[0] + '.arrow', table['batch'])
+
+def query_table(df, args):
+    """
+    Apply search, column filters, sorting and paging from request arguments to a table.
+
+    Supported arguments:
+    - search: Case-insensitive text searched in every column
+    - filter[<column>]: Case-insensitive text searched in one column
+    - sort, order: Column to sort by and "asc" or "desc"
+    - page, page_size: 1-based page number and rows per page
+
+    Returns:
+    - Dictionary with the page rows and paging information
+    """
+    total = len(df)
+
+    search = args.get('search', '').strip()
+    if search and len(df):
+        mask = np.zeros(len(df), dtype=bool)
+        for col in df.columns:
+            mask |= df[col].astype(str).str.contains(search, case=False, regex=False, na=False).to_numpy()
+        df = df[mask]
+
+    for key, value in args.items():
+        if key.startswith('filter[') and key.endswith(']') and value:
+            col = key[len('filter['):-1]
+            if col in df.columns:
+                df = df[df[col].astype(str).str.contains(value, case=False, regex=False, na=False)]
+
+    sort = args.get('sort')
+    if sort in df.columns:
+        df = df.sort_values(sort, ascending=args.get('order', 'asc') != 'desc', kind='stable')
+
+    page_size = min(max(args.get('page_size', 50, type=int), 1), 1000)
+    page = max(args.get('page', 1, type=int), 1)
+    page_rows = df.iloc[(page - 1) * page_size:page * page_size]
+
+    return {
+        "columns": list(df.columns),
+        "total": total,
+        "filtered": len(df),
+        "page": page,
+        "page_size": page_size,
+        "rows": json.loads(page_rows.to_json(orient='records'))
+    }
+
+@app.route('/api/results/<result_id>/<path:table>')
+def result_table_api(result_id, table):
+    """
+    Paginated access to one table of a stored comparison.
+    The result ID is the JSON file name without extension; the table is "<section>/<name>",
+    e.g. "failed_comparisons/A_only" or "all_data/all_failed_A".
+    """
+    if secure_filename(result_id) != result_id:
+        return jsonify({"error": "Invalid result"}), 400
+
+    json_filepath = result_cache.path(result_id + '.json')
+    if not os.path.exists(json_filepath):
+        return jsonify({"error": "Result data not found"}), 404
+    artifact_store.touch(result_id)
+
+    # Stored results never change, so a repeated query is answered without reading the table
+    last_modified = os.path.getmtime(json_filepath)
+    etag = file_etag([json_filepath], table, request.query_string.decode('utf-8'), app.config['SERVER_SIDE_LINKS'])
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    section, _, name = table.partition('/')
+    try:
+        with metrics.stage("table"):
+            df = load_result_table(json_filepath, os.path.getmtime(json_filepath), section, name)
+    except KeyError:
+        return jsonify({"error": "Unknown table"}), 404
+
+    with metrics.stage("query"):
+        response = query_table(df, request.args)
+    if app.config['SERVER_SIDE_LINKS'] and "ID" in response["columns"]:
+        ids, flags = link_id_cells([row["ID"] for row in response["rows"]])
+        for row, value in zip(response["rows"], ids):
+            row["ID"] = value
+        # Only cells flagged here are HTML; the page shows every other cell as text
+        response["linked"] = {"ID": flags}
+    response["table"] = table
+    return with_validators(jsonify(response), etag, last_modified)
+
 @app.route('/download/<filename>')
 def download(filename):
-    return send_file(os.path.join(app.config['RESULT_FOLDER'], filename), as_attachment=True)
+    """
+    Send the Excel file of a result, building it from the stored result on first request.
+    The optional `sheets` argument selects the sheet groups to include, comma separated
+    (raw, all, comparisons, matrix), e.g. ?sheets=all,comparisons,matrix to leave out the raw data.
+    """
+    sheet_groups = default_sheet_groups()
+    if 'sheets' in request.args:
+        requested = [group.strip() for group in request.args['sheets'].split(',') if group.strip()]
+        unknown = [group for group in requested if group not in workbook.SHEET_GROUPS]
+        if unknown or not requested:
+            message = (f"Unknown sheet groups: {', '.join(unknown)}. " if unknown else "No sheet groups selected. ")
+            return Response(message + f"Valid groups: {', '.join(workbook.SHEET_GROUPS)}",
+                            status=400, mimetype='text/plain')
+        sheet_groups = [group for group in workbook.SHEET_GROUPS if group in requested]
+
+    try:
+        excel_path = ensure_result_workbook(filename, sheet_groups)
+    except FileNotFoundError:
+        flash('Error: Result file not found.', 'danger')
+        return redirect(url_for('index'))
+
+    artifact_store.touch(filename.split('.', 1)[0])
+    return send_file(excel_path, as_attachment=True, download_name=filename)
+
+def default_sheet_groups():
+    if app.config['INCLUDE_RAW_DATA_SHEETS']:
+        return list(workbook.SHEET_GROUPS)
+    return [group for group in workbook.SHEET_GROUPS if group != 'raw']
+
+def ensure_result_workbook(filename, sheet_groups=None):
+    """
+    Return the path of a result workbook, generating it from the stored result if needed.
+    Workbooks are cached next to the result: "<stem>.xlsx" holds the default sheet groups,
+    other selections are stored as "<stem>.<groups>.xlsx".
+
+    Parameters:
+    - filename: Name of the result workbook ("<stem>.xlsx")
+    - sheet_groups: Sheet groups to include (defaults to default_sheet_groups())
+    """
+    if secure_filename(filename) != filename:
+        raise FileNotFoundError(filename)
+
+    stem = os.path.splitext(filename)[0]
+    sheet_groups = default_sheet_groups() if sheet_groups is None else sheet_groups
+    if sheet_groups == default_sheet_groups():
+        workbook_name = stem + '.xlsx'
+    else:
+        workbook_name = f"{stem}.{'-'.join(sheet_groups) or 'empty'}.xlsx"
+    excel_path = result_cache.path(workbook_name)
+
+    with get_workbook_lock(excel_path):
+        if os.path.exists(excel_path):
+            return excel_path
+
+        json_filepath = result_cache.path(stem + '.json')
+        tables_path = result_cache.path(stem + '.arrow')
+        if not (os.path.exists(json_filepath) and os.path.exists(tables_path)):
+            raise FileNotFoundError(filename)
+
+        manifest = load_result_manifest(json_filepath, os.path.getmtime(json_filepath))
+        temp_path = result_cache.temp_path(workbook_name)
+        with metrics.stage("excel"):
+            workbook.write_result_workbook(temp_path, manifest, tables_path, sheet_groups,
+                                           app.config['CSV_CHUNK_SIZE'])
+        os.replace(temp_path, excel_path)
+
+    artifact_store.sweep(keep={stem})
+    return excel_path
+
+def get_workbook_lock(excel_path):
+    # The same lock for every request of a workbook, so concurrent first downloads build it only once
+    return _workbook_locks[hash(excel_path) % len(_workbook_locks)]
 
 @app.route('/direct-results/<filename>')
 def direct_results(filename):
@@ -184,384 +1091,312 @@ def direct_results(filename):
     Alternative endpoint that loads Excel file directly by name.
     Useful for accessing results when JSON data is not available.
     """
-    excel_path = os.path.join(app.config['RESULT_FOLDER'], filename)
+    excel_path = result_cache.path(filename)
 
     if not os.path.exists(excel_path):
-        flash('Error: Result file not found.', 'danger')
-        return redirect(url_for('index'))
+        try:
+            excel_path = ensure_result_workbook(filename)
+        except FileNotFoundError:
+            flash('Error: Result file not found.', 'danger')
+            return redirect(url_for('index'))
+    artifact_store.touch(filename.split('.', 1)[0])
+
+    # The page only depends on the workbook and the template, unless messages are pending
+    last_modified = max(os.path.getmtime(excel_path), template_version('results.html') / 1e9)
+    etag = file_etag([excel_path], template_version('results.html'), filename)
+    cacheable = not session.get('_flashes')
+    if cacheable and (response := not_modified(etag, last_modified)) is not None:
+        return response
+
+    def render():
+        # Only the summary and the matrix are read here; every table is read from its sheet
+        # when the streamed page reaches it
+        with metrics.stage("workbook"):
+            excel_workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+            try:
+                excel_data, tables = workbook_page_data(excel_workbook)
+            except Exception:
+                excel_workbook.close()
+                raise
+        return stream_page('results.html', tables, [excel_workbook], filename=filename, data=excel_data)
 
     try:
-        # Read the Excel file directly
-        excel_data = {}
-
-        # Read the Excel file to get file names and data
-        xl = pd.ExcelFile(excel_path)
-        sheet_names = xl.sheet_names
-
-        # Try to extract file names from the sheets
-        file_names = []
-        for sheet in sheet_names:
-            if sheet.startswith('All_Data_'):
-                file_name = sheet.replace('All_Data_', '')
-                if file_name not in file_names:
-                    file_names.append(file_name)
-
-        excel_data['file_names'] = file_names
-        excel_data['file_count'] = len(file_names)
-
-        # Create a summary based on sheet names
-        summary = {}
-        for sheet in sheet_names:
-            if "_in_" in sheet and not sheet.startswith('All_'):
-                key = sheet.replace('_', ' ')
-                df = pd.read_excel(excel_path, sheet_name=sheet)
-                summary[key] = len(df)
-
-        # Add combined stats
-        for sheet in sheet_names:
-            if sheet.startswith('All_'):
-                key = sheet.replace('_', ' ')
-                df = pd.read_excel(excel_path, sheet_name=sheet)
-                summary[key] = len(df)
-
-        excel_data['summary'] = summary
-
-        # Read the comparison matrix if it exists
-        if 'Comparison_Matrix' in sheet_names:
-            matrix_df = pd.read_excel(excel_path, sheet_name='Comparison_Matrix')
-            matrix_data = matrix_df.to_dict(orient='records')
-            excel_data['matrix'] = matrix_data
-
-        # Read all the sheets
-        for sheet in sheet_names:
-            if not sheet.startswith('All_Data_') and sheet != 'Comparison_Matrix':  # Skip raw data sheets
-                df = pd.read_excel(excel_path, sheet_name=sheet)
-
-                # Apply hyperlinks to IDs
-                if 'ID' in df.columns:
-                    additional_cols = [col for col in df.columns if col.endswith(' ID')]
-                    df = create_hyperlink_for_ids(df, "ID", additional_cols)
-
-                key = sheet.lower()
-                excel_data[key] = df.to_html(classes='table table-striped table-bordered table-hover',
-                                            index=False, escape=False)
-
-        # Now include the "All_Data" sheets for reference
-        for sheet in sheet_names:
-            if sheet.startswith('All_Data_'):
-                df = pd.read_excel(excel_path, sheet_name=sheet)
-                if 'ID' in df.columns:
-                    df = create_hyperlink_for_ids(df, "ID")
-                key = sheet.lower()
-                excel_data[key] = df.to_html(classes='table table-striped table-bordered table-hover',
-                                            index=False, escape=False)
-
-        return render_template('results.html', filename=filename, data=excel_data)
+        if not cacheable:
+            # Rendered before responding, so the session cookie drops the messages shown
+            return ''.join(render())
+        if secure_filename(filename) == filename:
+            response = result_page_response(os.path.splitext(filename)[0], 'direct', etag, render)
+        else:
+            response = page_response(render())
+        return with_validators(response, etag, last_modified)
     except Exception as e:
         flash(f'Error processing Excel file: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
-def process_csv_files(file_paths, file_names):
+def sheet_row_count(worksheet):
     """
-    Process multiple CSV files and compare their test cases.
-    Returns the path to the Excel file and the comparison data.
+    Number of rows below the header of a read-only sheet, from the dimension the writer
+    recorded; sheets without one are read to the end.
+    """
+    if worksheet.max_row is not None:
+        return max(worksheet.max_row - 1, 0)
+    return max(sum(1 for _ in worksheet.iter_rows(values_only=True)) - 1, 0)
+
+def read_sheet(excel_workbook, sheet):
+    """
+    Read one sheet of a read-only workbook as a DataFrame, its first row being the header.
+    """
+    rows = excel_workbook[sheet].iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    return pd.DataFrame.from_records(list(rows), columns=list(header))
+
+def render_sheet_table(excel_workbook, sheet):
+    """
+    Read one sheet of a result workbook and render it as the results page shows it.
+    """
+    df = read_sheet(excel_workbook, sheet)
+    # Apply hyperlinks to IDs
+    if 'ID' in df.columns:
+        additional_cols = [col for col in df.columns if col.endswith(' ID')]
+        df = create_hyperlink_for_ids(df, "ID", additional_cols)
+    return df.to_html(classes='table table-striped table-bordered table-hover', index=False, escape=False,
+                      na_rep='')
+
+def workbook_page_data(excel_workbook):
+    """
+    Build the results page data from an open read-only result workbook without reading its
+    tables: row counts come from the sheet dimensions, only the matrix sheet is read, and
+    every displayed table is a placeholder rendered from its sheet while the page is
+    streamed (see stream_page).
 
     Parameters:
-    - file_paths: List of paths to the CSV files
-    - file_names: List of names for the CSV files
+    - excel_workbook: Result workbook opened with read_only=True
+
+    Returns:
+    - The page data and the list of table functions its placeholders refer to
     """
-    # Columns to include in the output
-    columns = ["ID", "Title", "Case ID", "Comment", "Plan", "Status", "Tested By"]
-
-    # Load data from CSV files into a dictionary of dataframes
-    file_data = {}
-    for i, file_path in enumerate(file_paths):
-        file_data[file_names[i]] = pd.read_csv(file_path)
-
-    # Define functions for comparison
-    def get_pass_fail(df):
-        """Split a dataframe into passed and failed tests"""
-        passed = df[df["Status"].str.lower() == "passed"]
-        failed = df[df["Status"].str.lower() == "failed"]
-        return passed, failed
-
-    def filter_minor(df):
-        """Filter tests with minor or bypass in comments"""
-        return df[df["Comment"].str.contains(r"(?i)\b(minor|bypass)", case=False, na=False)]
-
-    # Process each file to get passed, failed, and minor cases
-    passed_data = {}
-    failed_data = {}
-    minor_data = {}
-    case_id_sets = {}  # For storing sets of Case IDs by category
-
-    for file_name, df in file_data.items():
-        # Get passed and failed tests
-        passed, failed = get_pass_fail(df)
-        passed_data[file_name] = passed
-        failed_data[file_name] = failed
-
-        # Get minor cases
-        minor = filter_minor(df)
-        minor_data[file_name] = minor
-
-        # Create sets of Case IDs
-        case_id_sets[f"{file_name}_passed"] = set(passed["Case ID"])
-        case_id_sets[f"{file_name}_failed"] = set(failed["Case ID"])
-        case_id_sets[f"{file_name}_minor"] = set(minor["Case ID"])
-
-    # Generate comparison sets for all possible file combinations
-    comparisons = {
-        "failed": {},
-        "passed": {},
-        "minor": {}
-    }
+    sheet_names = excel_workbook.sheetnames
+    row_counts = {sheet: sheet_row_count(excel_workbook[sheet]) for sheet in sheet_names}
 
-    # Function to get all combinations of file names
-    def get_file_combinations(file_list, r):
-        return list(itertools.combinations(file_list, r))
+    excel_data = {}
 
-    # For each file, find cases unique to that file
-    for file_name in file_names:
-        # Unique failed cases
-        failed_in_this_file = case_id_sets[f"{file_name}_failed"]
-        failed_in_other_files = set()
-        for other_file in file_names:
-            if other_file != file_name:
-                failed_in_other_files.update(case_id_sets[f"{other_file}_failed"])
-
-        unique_failed = failed_in_this_file - failed_in_other_files
-        comparisons["failed"][f"{file_name}_only"] = failed_data[file_name][
-            failed_data[file_name]["Case ID"].isin(unique_failed)
-        ][columns]
-
-        # Unique passed cases
-        passed_in_this_file = case_id_sets[f"{file_name}_passed"]
-        passed_in_other_files = set()
-        for other_file in file_names:
-            if other_file != file_name:
-                passed_in_other_files.update(case_id_sets[f"{other_file}_passed"])
-
-        unique_passed = passed_in_this_file - passed_in_other_files
-        comparisons["passed"][f"{file_name}_only"] = passed_data[file_name][
-            passed_data[file_name]["Case ID"].isin(unique_passed)
-        ][columns]
-
-        # Unique minor cases
-        minor_in_this_file = case_id_sets[f"{file_name}_minor"]
-        minor_in_other_files = set()
-        for other_file in file_names:
-            if other_file != file_name:
-                minor_in_other_files.update(case_id_sets[f"{other_file}_minor"])
-
-        unique_minor = minor_in_this_file - minor_in_other_files
-        comparisons["minor"][f"{file_name}_only"] = minor_data[file_name][
-            minor_data[file_name]["Case ID"].isin(unique_minor)
-        ][columns]
-
-    # Find intersections for each pair of files
-    for i in range(2, len(file_names) + 1):
-        file_combos = get_file_combinations(file_names, i)
-
-        for combo in file_combos:
-            combo_name = "_and_".join(combo)
-
-            # Failed in all files in this combination
-            failed_in_all = set.intersection(*[case_id_sets[f"{file}_failed"] for file in combo])
-            failed_in_rest = set()
-            for file in file_names:
-                if file not in combo:
-                    failed_in_rest.update(case_id_sets[f"{file}_failed"])
-            unique_to_combo = failed_in_all - failed_in_rest
-
-            if unique_to_combo:  # Only add if there are results
-                # Use the first file's data as a base
-                base_file = combo[0]
-                comparisons["failed"][combo_name] = failed_data[base_file][
-                    failed_data[base_file]["Case ID"].isin(unique_to_combo)
-                ][columns]
-
-            # Passed in all files in this combination
-            passed_in_all = set.intersection(*[case_id_sets[f"{file}_passed"] for file in combo])
-            passed_in_rest = set()
-            for file in file_names:
-                if file not in combo:
-                    passed_in_rest.update(case_id_sets[f"{file}_passed"])
-            unique_to_combo = passed_in_all - passed_in_rest
-
-            if unique_to_combo:  # Only add if there are results
-                # Use the first file's data as a base
-                base_file = combo[0]
-                comparisons["passed"][combo_name] = passed_data[base_file][
-                    passed_data[base_file]["Case ID"].isin(unique_to_combo)
-                ][columns]
-
-            # Minor in all files in this combination
-            minor_in_all = set.intersection(*[case_id_sets[f"{file}_minor"] for file in combo])
-            minor_in_rest = set()
-            for file in file_names:
-                if file not in combo:
-                    minor_in_rest.update(case_id_sets[f"{file}_minor"])
-            unique_to_combo = minor_in_all - minor_in_rest
-
-            if unique_to_combo:  # Only add if there are results
-                # Use the first file's data as a base
-                base_file = combo[0]
-                comparisons["minor"][combo_name] = minor_data[base_file][
-                    minor_data[base_file]["Case ID"].isin(unique_to_combo)
-                ][columns]
-
-    # Special case: Find cases that are in all files
-    if len(file_names) > 1:
-        # Failed in all files
-        failed_in_all_files = set.intersection(*[case_id_sets[f"{file}_failed"] for file in file_names])
-        if failed_in_all_files:
-            comparisons["failed"]["all_files"] = failed_data[file_names[0]][
-                failed_data[file_names[0]]["Case ID"].isin(failed_in_all_files)
-            ][columns]
-
-        # Passed in all files
-        passed_in_all_files = set.intersection(*[case_id_sets[f"{file}_passed"] for file in file_names])
-        if passed_in_all_files:
-            comparisons["passed"]["all_files"] = passed_data[file_names[0]][
-                passed_data[file_names[0]]["Case ID"].isin(passed_in_all_files)
-            ][columns]
-
-        # Minor in all files
-        minor_in_all_files = set.intersection(*[case_id_sets[f"{file}_minor"] for file in file_names])
-        if minor_in_all_files:
-            comparisons["minor"]["all_files"] = minor_data[file_names[0]][
-                minor_data[file_names[0]]["Case ID"].isin(minor_in_all_files)
-            ][columns]
-
-    # Write results to Excel file
-    output_filename = 'multi_case_comparison_result.xlsx'
-    output_path = os.path.join(app.config['RESULT_FOLDER'], output_filename)
-
-    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-        # Write original file data
-        for file_name, df in file_data.items():
-            df.to_excel(writer, sheet_name=f"All_Data_{file_name}", index=False)
-
-        # Write all failed, passed, and minor data
-        for file_name in file_names:
-            failed_data[file_name][columns].to_excel(writer, sheet_name=f"All_Failed_{file_name}", index=False)
-            passed_data[file_name][columns].to_excel(writer, sheet_name=f"All_Passed_{file_name}", index=False)
-            minor_data[file_name][columns].to_excel(writer, sheet_name=f"All_Minor_{file_name}", index=False)
-
-        # Write comparison results
-        for category, category_comparisons in comparisons.items():
-            for name, df in category_comparisons.items():
-                sheet_name = f"{category.capitalize()}_in_{name}"
-                # Truncate sheet name if too long (Excel has 31 character limit)
-                if len(sheet_name) > 31:
-                    sheet_name = sheet_name[:28] + "..."
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-        # Create and write comparison matrix
-        matrix_data = create_comparison_matrix(case_id_sets, file_names)
-        matrix_df = pd.DataFrame(matrix_data)
-        matrix_df.to_excel(writer, sheet_name="Comparison_Matrix", index=False)
-
-    # Generate summary statistics
-    summary = {}
+    # Try to extract file names from the sheets (All_Data_* sheets are optional)
+    file_names = []
+    for sheet in sheet_names:
+        for prefix in ('All_Data_', 'All_Failed_'):
+            if sheet.startswith(prefix):
+                file_name = sheet.replace(prefix, '', 1)
+                if file_name not in file_names:
+                    file_names.append(file_name)
 
-    # Add file counts
+    excel_data['file_names'] = file_names
+    excel_data['file_count'] = len(file_names)
+
+    # Create a summary based on sheet names and row counts
+    summary = {}
+    for sheet in sheet_names:
+        if "_in_" in sheet and not sheet.startswith('All_'):
+            summary[sheet.replace('_', ' ')] = row_counts[sheet]
+    for sheet in sheet_names:
+        if sheet.startswith('All_'):
+            summary[sheet.replace('_', ' ')] = row_counts[sheet]
+
+    # Per file statistics in the same form as process_csv_files
     for file_name in file_names:
-        summary[f"Total cases in {file_name}"] = len(file_data[file_name])
-        summary[f"Failed cases in {file_name}"] = len(failed_data[file_name])
-        summary[f"Passed cases in {file_name}"] = len(passed_data[file_name])
-        summary[f"Minor cases in {file_name}"] = len(minor_data[file_name])
-
-    # Add comparison counts
-    for category, category_comparisons in comparisons.items():
-        for name, df in category_comparisons.items():
-            summary[f"{category.capitalize()} in {name}"] = len(df)
-
-    # Prepare hyperlinked DataFrames for web display
-    web_comparisons = {
-        "failed": {},
-        "passed": {},
-        "minor": {}
-    }
+        if f"All_Data_{file_name}" in row_counts:
+            summary[f"Total cases in {file_name}"] = row_counts[f"All_Data_{file_name}"]
+        for category in ("Failed", "Passed", "Minor"):
+            if f"All_{category}_{file_name}" in row_counts:
+                summary[f"{category} cases in {file_name}"] = row_counts[f"All_{category}_{file_name}"]
+
+    excel_data['summary'] = summary
+
+    # Read the comparison matrix if it exists
+    if 'Comparison_Matrix' in sheet_names:
+        excel_data['matrix'] = read_sheet(excel_workbook, 'Comparison_Matrix').to_dict(orient='records')
+
+    # Placeholders for the remaining sheets, in the sections used by the results template
+    for section in ('failed_comparisons', 'passed_comparisons', 'minor_comparisons', 'all_data'):
+        excel_data[section] = {}
+
+    tables = []
+    for sheet in sheet_names:
+        # Raw data sheets are only counted, never displayed
+        if sheet.startswith('All_Data_') or sheet == 'Comparison_Matrix':
+            continue
+        placeholder = table_placeholder(len(tables))
+        tables.append(lambda sheet=sheet: render_sheet_table(excel_workbook, sheet))
+
+        # "All_Failed_A" -> all_data["all_failed_A"], "Failed_in_A_only" -> failed_comparisons["A_only"]
+        prefix = next((p for p in ('All_Failed_', 'All_Passed_', 'All_Minor_') if sheet.startswith(p)), None)
+        category, _, name = sheet.partition('_in_')
+        if prefix:
+            excel_data['all_data'][prefix.lower() + sheet[len(prefix):]] = placeholder
+        elif name and category in ('Failed', 'Passed', 'Minor'):
+            excel_data[f"{category.lower()}_comparisons"][name] = placeholder
+        else:
+            excel_data[sheet.lower()] = placeholder
+
+    return excel_data, tables
+
+def load_run(file_path, file_digest=None):
+    """
+    Parse and classify one CSV file, through the parsed data cache when a digest is given.
+    Runs in a worker process when files are parsed in parallel.
+    """
+    if file_digest:
+        return load_run_cached(file_path, file_digest)
+    return comparison.read_classified_csv(file_path, app.config['CSV_CHUNK_SIZE'],
+                                          app.config['CLASSIFICATION_RULES'])
+
+def get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # Spawned workers avoid forking the threads of the web server and job queue
+            _parse_pool = ProcessPoolExecutor(max_workers=app.config['PARSE_WORKERS'],
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return _parse_pool
+
+def discard_parse_pool(pool):
+    """
+    Forget a broken parse pool (e.g. a worker was killed), so the next job starts a new one.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
 
-    for category, category_comparisons in comparisons.items():
-        for name, df in category_comparisons.items():
-            web_comparisons[category][name] = create_hyperlink_for_ids(df, "ID").to_json(orient='records')
+def load_runs(file_paths, file_digests=None, report=None):
+    """
+    Parse and classify every CSV file, in parallel worker processes when the input is big enough.
+    Small inputs are parsed serially, where starting the workers would cost more than it saves.
 
-    # Prepare data for all files with hyperlinks
-    all_data_web = {}
-    for file_name in file_names:
-        all_failed = create_hyperlink_for_ids(failed_data[file_name][columns], "ID")
-        all_passed = create_hyperlink_for_ids(passed_data[file_name][columns], "ID")
-        all_minor = create_hyperlink_for_ids(minor_data[file_name][columns], "ID")
-
-        all_data_web[f"all_failed_{file_name}"] = all_failed.to_json(orient='records')
-        all_data_web[f"all_passed_{file_name}"] = all_passed.to_json(orient='records')
-        all_data_web[f"all_minor_{file_name}"] = all_minor.to_json(orient='records')
-
-    # Create a dictionary with all comparison data
-    comparison_data = {
-        "summary": summary,
-        "file_names": file_names,
-        "file_count": len(file_names),
-        "matrix": matrix_data,
-        "failed_comparisons": web_comparisons["failed"],
-        "passed_comparisons": web_comparisons["passed"],
-        "minor_comparisons": web_comparisons["minor"],
-        "all_data": all_data_web
-    }
+    Parameters:
+    - file_paths: List of paths to the CSV files, or of their contents as bytes
+    - file_digests: Optional SHA-256 digests of the CSV files
+    - report: Optional callback(done, total) called as files finish
+
+    Returns:
+    - List of classified runs, in the order of file_paths
+    """
+    digests = file_digests or [None] * len(file_paths)
+    total_bytes = sum(uploads.source_size(source) for source in file_paths)
+    parallel = (app.config['PARSE_WORKERS'] > 1 and len(file_paths) > 1
+                and total_bytes >= app.config['PARALLEL_PARSE_MIN_BYTES'])
+
+    runs = [None] * len(file_paths)
+    if not parallel:
+        for i, (file_path, digest) in enumerate(zip(file_paths, digests)):
+            if report:
+                report(i, len(file_paths))
+            runs[i] = load_run(file_path, digest)
+        return runs
+
+    pool = get_parse_pool()
+    try:
+        futures = {pool.submit(load_run, file_path, digest): i
+                   for i, (file_path, digest) in enumerate(zip(file_paths, digests))}
+        for done, future in enumerate(as_completed(futures)):
+            runs[futures[future]] = future.result()
+            if report:
+                report(done + 1, len(file_paths))
+    except BrokenProcessPool as e:
+        # A worker died; the files it did not finish are parsed here instead
+        app.logger.warning("Parse worker pool broke (%s), parsing serially", e)
+        discard_parse_pool(pool)
+        for i, (file_path, digest) in enumerate(zip(file_paths, digests)):
+            if runs[i] is None:
+                runs[i] = load_run(file_path, digest)
+        if report:
+            report(len(file_paths), len(file_paths))
+    return runs
+
+def process_csv_files(file_paths, file_names, progress=None, file_digests=None, sources=None):
+    """
+    Process multiple CSV files and compare their test cases.
+    Returns the comparison data; the Excel workbook is built from the stored result on
+    first download (see write_result_workbook).
+
+    Parameters:
+    - file_paths: List of paths to the CSV files
+    - file_names: List of names for the CSV files
+    - progress: Optional callback(stage, percent) used to report job progress
+    - file_digests: Optional SHA-256 digests of the CSV files; when given, parsed data is
+      read from and stored in the parsed data cache
+    - sources: Optional CSV sources to parse instead of file_paths, e.g. uploads read into
+      memory (see uploads.upload_source); file_paths are then only recorded
+    """
+    def report(done, total):
+        if progress:
+            progress("parse", 100 * done // max(total, 1))
+
+    # Read and classify each CSV file chunk by chunk, one worker process per file when worthwhile
+    with metrics.stage("parse"):
+        runs = load_runs(sources or file_paths, file_digests, report)
+    record_history(runs, file_names, file_paths, file_digests)
 
-    return output_path, comparison_data
+    return comparison.compare_runs(runs, file_names, file_paths, file_digests, progress)
 
-def create_comparison_matrix(case_id_sets, file_names):
+def compare_history_runs(run_ids, file_names, progress=None):
     """
-    Create a matrix showing overlap of cases between files.
+    Compare runs of the history store (see history.load_run); their CSV files are not needed.
 
     Parameters:
-    - case_id_sets: Dictionary containing sets of Case IDs for each file and category
-    - file_names: List of file names
+    - run_ids: IDs of the stored runs, in comparison order
+    - file_names: Names of the runs in the comparison
+    - progress: Optional callback(stage, percent) used to report job progress
+    """
+    stored = history.get_runs(app.config['HISTORY_DB'], run_ids)
+    runs = []
+    with metrics.stage("parse"):
+        for i, run_id in enumerate(run_ids):
+            if progress:
+                progress("parse", 100 * i // len(run_ids))
+            runs.append(history.load_run(app.config['HISTORY_DB'], run_id))
+
+    return comparison.compare_runs(runs, file_names, [run['source_file'] for run in stored],
+                                   [run['file_digest'] for run in stored], progress)
+
+def record_history(runs, file_names, file_paths, file_digests=None):
+    """
+    Store classified runs in the history database, unless the history is turned off.
+    Files already stored with the same rules are not stored again.
+    """
+    if not app.config['HISTORY_DB']:
+        return
+    digests = file_digests or [cache.file_digest(path) for path in file_paths]
+    with metrics.stage("history"):
+        for run, file_name, file_path, digest in zip(runs, file_names, file_paths, digests):
+            history.ingest_run(app.config['HISTORY_DB'], run, file_name, digest, file_path)
+
+def add_run_to_comparison(manifest, tables_path, file_path, file_name, file_digest=None, progress=None,
+                          source=None, cases_path=None):
+    """
+    Extend a stored comparison with one more CSV file, without parsing the earlier files again.
+    Only the new file is parsed and classified; see comparison.extend_comparison.
 
-    Returns:
-    - List of dictionaries for the comparison matrix
-    """
-    matrix_data = []
-
-    # For each pair of files, calculate the overlap
-    for i, file1 in enumerate(file_names):
-        for j, file2 in enumerate(file_names[i:], i):
-            # Skip comparing a file to itself
-            if file1 == file2 and i == j:
-                continue
-
-            # Calculate intersection sizes
-            failed_intersection = len(case_id_sets[f"{file1}_failed"] & case_id_sets[f"{file2}_failed"])
-            passed_intersection = len(case_id_sets[f"{file1}_passed"] & case_id_sets[f"{file2}_passed"])
-            minor_intersection = len(case_id_sets[f"{file1}_minor"] & case_id_sets[f"{file2}_minor"])
-
-            # Calculate union sizes (for Jaccard similarity)
-            failed_union = len(case_id_sets[f"{file1}_failed"] | case_id_sets[f"{file2}_failed"])
-            passed_union = len(case_id_sets[f"{file1}_passed"] | case_id_sets[f"{file2}_passed"])
-            minor_union = len(case_id_sets[f"{file1}_minor"] | case_id_sets[f"{file2}_minor"])
-
-            # Calculate Jaccard similarity (intersection / union)
-            failed_jaccard = failed_intersection / failed_union if failed_union > 0 else 0
-            passed_jaccard = passed_intersection / passed_union if passed_union > 0 else 0
-            minor_jaccard = minor_intersection / minor_union if minor_union > 0 else 0
-
-            # Add to matrix data
-            matrix_data.append({
-                "File 1": file1,
-                "File 2": file2,
-                "Failed Overlap": failed_intersection,
-                "Failed Jaccard": round(failed_jaccard, 3),
-                "Passed Overlap": passed_intersection,
-                "Passed Jaccard": round(passed_jaccard, 3),
-                "Minor Overlap": minor_intersection,
-                "Minor Jaccard": round(minor_jaccard, 3)
-            })
-
-    return matrix_data
+    Parameters:
+    - manifest: Manifest of the stored comparison (see result_store)
+    - tables_path: Path to the Arrow file with the stored tables
+    - file_path: Path to the new CSV file
+    - file_name: Name of the new file (checked with comparison.check_extendable by the caller)
+    - file_digest: Optional SHA-256 digest of the new file
+    - progress: Optional callback(stage, percent) used to report job progress
+    - source: Optional CSV source to parse instead of file_path (see uploads.upload_source)
+    - cases_path: Optional path to the case index stored with the comparison
+    """
+    file_digest = file_digest or cache.source_digest(source or file_path)
+
+    if progress:
+        progress("parse", 0)
+    with metrics.stage("parse"):
+        run = load_run(source or file_path, file_digest)
+    record_history([run], [file_name], [file_path], [file_digest])
+
+    return comparison.extend_comparison(manifest, tables_path, run, file_path, file_name, file_digest, progress,
+                                        cases_path)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
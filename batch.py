@@ -0,0 +1,263 @@
+"""
+Compare many sets of TestRail runs from the command line, without the web app.
+
+Groups of runs come from a directory tree (every directory with two or more CSV files is a
+group, compared in file name order, so the last file is the latest run) or from a JSON
+manifest:
+
+    {"groups": {"nightly-a": ["runs/a/1.csv", "runs/a/2.csv"],
+                "nightly-b": [{"name": "RC", "path": "rc.csv"}, {"name": "Main", "path": "main.csv"}]}}
+
+Every group gets a directory in the output folder with summary.json, and optionally the
+result tables (result.json + result.arrow, as stored by the web app) and result.xlsx.
+The exit status is 1 when a group exceeds a threshold and 2 when a group could not be compared:
+
+    python batch.py --root nightly/ --output reports/ --workers 8 --max-new-failures 0
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+EXIT_OK = 0
+EXIT_THRESHOLD = 1
+EXIT_ERROR = 2
+
+# Latest run statistics that can be checked against a --max-<name> threshold
+CHECKS = {
+    "new_failures": "failed cases of the latest run that failed in no earlier run",
+    "passed_to_failed": "cases passed in the previous run and failed in the latest run",
+    "failed": "failed cases in the latest run"
+}
+
+
+def discover_groups(root):
+    """
+    Find the groups of a directory tree: every directory with at least two CSV files.
+    Returns a dictionary of group name (path relative to root) -> list of (name, path).
+    """
+    groups = {}
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        csv_files = sorted(name for name in files if name.lower().endswith('.csv'))
+        if len(csv_files) < 2:
+            continue
+        group_name = os.path.relpath(directory, root)
+        groups[group_name] = [(os.path.splitext(name)[0], os.path.join(directory, name)) for name in csv_files]
+    return groups
+
+
+def load_manifest(manifest_path):
+    """
+    Read the groups of a JSON manifest. Relative paths are resolved against the manifest folder.
+    Returns a dictionary of group name -> list of (name, path).
+    Raises ValueError for a group with fewer than two runs, as the latest run is compared with
+    the previous one.
+    """
+    with open(manifest_path) as f:
+        groups = json.load(f).get("groups", {})
+
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    loaded = {}
+    for group_name, files in groups.items():
+        entries = []
+        for entry in files:
+            if isinstance(entry, str):
+                entry = {"path": entry}
+            path = os.path.join(base, entry["path"])
+            entries.append((entry.get("name") or os.path.splitext(os.path.basename(path))[0], path))
+        if len(entries) < 2:
+            raise ValueError(f"Group {group_name} of {manifest_path} has {len(entries)} run(s); "
+                             f"every group needs at least two")
+        loaded[group_name] = entries
+    return loaded
+
+
+def group_folder_name(group_name):
+    return re.sub(r'[^\w.-]+', '_', group_name).strip('._') or 'group'
+
+
+def group_folders(group_names):
+    """
+    Output folder name of every group (see group_folder_name). Groups whose names map to the
+    same folder, e.g. "a/b" and "a_b", get a numbered suffix in name order, so no group
+    overwrites the outputs of another. Names differing only in case count as the same folder.
+    """
+    folders = {}
+    used = set()
+    for group_name in sorted(group_names):
+        base = group_folder_name(group_name)
+        folder = base
+        suffix = 2
+        while folder.lower() in used:
+            folder = f"{base}-{suffix}"
+            suffix += 1
+        used.add(folder.lower())
+        folders[group_name] = folder
+    return folders
+
+
+def latest_run_stats(comparison_data):
+    """
+    Statistics of the latest (last) run of a comparison, as checked by the thresholds.
+    """
+    file_names = comparison_data["file_names"]
+    latest, previous = file_names[-1], file_names[-2]
+    new_failures = comparison_data["failed_comparisons"][f"{latest}_only"]["Case ID"].nunique()
+    pair = next(row for row in comparison_data["matrix"] if row["File 1"] == previous and row["File 2"] == latest)
+    return {
+        "latest": latest,
+        "previous": previous,
+        "new_failures": int(new_failures),
+        "passed_to_failed": pair["Passed to Failed"],
+        "failed": comparison_data["summary"][f"Failed cases in {latest}"]
+    }
+
+
+def compare_group(group_name, files, group_dir, options):
+    """
+    Compare one group of runs and write its outputs. Runs in a worker process.
+
+    Parameters:
+    - group_name: Name of the group
+    - files: List of (name, path) of the runs, oldest first
+    - group_dir: Folder to write the outputs of the group to (see group_folders)
+    - options: Dictionary with "chunk_size", "rules_file", "tables", "xlsx", "sheets" and "thresholds"
+    """
+    # Imported here so the command starts (and --help answers) without loading pandas
+    import comparison
+    import result_store
+    import workbook
+
+    file_names = [name for name, _ in files]
+    file_paths = [path for _, path in files]
+    if len(set(file_names)) != len(file_names):
+        raise ValueError("Run names must be unique within a group")
+
+    rules = comparison.load_rules(options["rules_file"])
+    runs = [comparison.read_classified_csv(path, options["chunk_size"], rules) for path in file_paths]
+    comparison_data = comparison.compare_runs(runs, file_names, file_paths)
+
+    os.makedirs(group_dir, exist_ok=True)
+    json_path = os.path.join(group_dir, "result.json")
+    tables_path = os.path.join(group_dir, "result.arrow")
+    if options["tables"] or options["xlsx"]:
+        result_store.write_result(json_path, tables_path, comparison_data)
+    if options["xlsx"]:
+        workbook.write_result_workbook(os.path.join(group_dir, "result.xlsx"), result_store.read_manifest(json_path),
+                                       tables_path, options["sheets"], options["chunk_size"])
+    if options["xlsx"] and not options["tables"]:
+        os.remove(json_path)
+        os.remove(tables_path)
+
+    stats = latest_run_stats(comparison_data)
+    exceeded = [f"{name} {stats[name]} > {limit}" for name, limit in options["thresholds"].items()
+                if limit is not None and stats[name] > limit]
+    report = {
+        "group": group_name,
+        "file_names": file_names,
+        "source_files": [os.path.abspath(path) for path in file_paths],
+        "latest_run": stats,
+        "exceeded": exceeded,
+        "summary": comparison_data["summary"],
+        "matrix": comparison_data["matrix"]
+    }
+    with open(os.path.join(group_dir, "summary.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def run_groups(groups, folders, output_dir, options, workers):
+    """
+    Compare every group with at most `workers` groups at the same time, each into its folder
+    of output_dir (see group_folders).
+    Yields (group name, report or None, error or None) as groups finish.
+    """
+    if workers <= 1 or len(groups) <= 1:
+        for group_name, files in groups.items():
+            try:
+                yield group_name, compare_group(group_name, files, os.path.join(output_dir, folders[group_name]),
+                                                options), None
+            except Exception as e:
+                yield group_name, None, str(e)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(compare_group, group_name, files, os.path.join(output_dir, folders[group_name]),
+                               options): group_name
+                   for group_name, files in groups.items()}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, str(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare groups of TestRail CSV exports without the web app")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--root", help="Directory tree; every directory with two or more CSV files is a group")
+    source.add_argument("--manifest", help="JSON manifest of the groups to compare")
+    parser.add_argument("--output", required=True, help="Folder to write one folder of results per group to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Groups compared at the same time")
+    parser.add_argument("--chunk-size", type=int, default=int(os.environ.get('CSV_CHUNK_SIZE', 50000)),
+                        help="Rows read at a time from the CSV files")
+    parser.add_argument("--rules", default=os.environ.get('CLASSIFICATION_RULES_FILE'),
+                        help="JSON file with the classification rules (statuses, minor keywords, per-plan overrides)")
+    parser.add_argument("--tables", action="store_true", help="Also write the result tables (JSON manifest + Arrow)")
+    parser.add_argument("--xlsx", action="store_true", help="Also write the Excel workbook")
+    parser.add_argument("--sheets", default="raw,all,comparisons,matrix",
+                        help="Sheet groups of the workbook, comma separated")
+    for name, description in CHECKS.items():
+        parser.add_argument(f"--max-{name.replace('_', '-')}", type=int, dest=f"max_{name}",
+                            help=f"Fail when the {description} exceed this number")
+    args = parser.parse_args(argv)
+
+    try:
+        groups = discover_groups(args.root) if args.root else load_manifest(args.manifest)
+    except ValueError as e:
+        print(f"ERROR {e}", file=sys.stderr)
+        return EXIT_ERROR
+    if not groups:
+        print("No groups to compare", file=sys.stderr)
+        return EXIT_ERROR
+
+    options = {
+        "chunk_size": args.chunk_size,
+        "rules_file": args.rules,
+        "tables": args.tables,
+        "xlsx": args.xlsx,
+        "sheets": [group for group in args.sheets.split(",") if group],
+        "thresholds": {name: getattr(args, f"max_{name}") for name in CHECKS}
+    }
+    os.makedirs(args.output, exist_ok=True)
+    folders = group_folders(groups)
+
+    index = {}
+    exit_code = EXIT_OK
+    for group_name, report, error in run_groups(groups, folders, args.output, options, args.workers):
+        if error is not None:
+            print(f"ERROR {group_name}: {error}")
+            index[group_name] = {"status": "error", "error": error}
+            exit_code = EXIT_ERROR
+            continue
+
+        stats = report["latest_run"]
+        status = "exceeded" if report["exceeded"] else "ok"
+        print(f"{status.upper():<8} {group_name}: {len(report['file_names'])} runs, latest {stats['latest']}: "
+              f"{stats['new_failures']} new failures, {stats['passed_to_failed']} passed -> failed"
+              + (f" ({'; '.join(report['exceeded'])})" if report["exceeded"] else ""))
+        index[group_name] = {"status": status, "folder": folders[group_name],
+                             "latest_run": stats, "exceeded": report["exceeded"]}
+        if report["exceeded"] and exit_code == EXIT_OK:
+            exit_code = EXIT_THRESHOLD
+
+    with open(os.path.join(args.output, "index.json"), "w") as f:
+        json.dump({"groups": dict(sorted(index.items()))}, f, indent=2)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
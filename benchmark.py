@@ -0,0 +1,365 @@
+"""
+Benchmark the comparison pipeline on synthetic TestRail exports, without the web server.
+
+Generates CSV files with tunable size, overlap between runs, status mix and share of
+minor/bypass comments, then times (and separately memory-profiles) every stage:
+parse, classify, combinations, matrix, hyperlinks, store (JSON manifest + Arrow tables),
+excel and the HTML rendering of the results pages. Results are written to a JSON file so
+runs from different commits can be compared:
+
+    python benchmark.py --rows 100000 --files 4 --output before.json
+    python benchmark.py --rows 100000 --files 4 --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import app as comparison_app
+import cache
+import comparison
+import result_store
+import storage
+import workbook
+
+# Columns of a TestRail test export; the last ones are not analysed but make the raw data realistic
+EXPORT_COLUMNS = ["ID", "Title", "Case ID", "Comment", "Plan", "Status", "Tested By",
+                  "Assigned To", "Defects", "Elapsed", "Priority", "Section", "Type"]
+OTHER_STATUSES = ["Retest", "Blocked", "Untested"]
+MINOR_COMMENTS = ["Minor UI glitch", "minor: wrong label", "Bypass with workaround", "bypass - known issue"]
+OTHER_COMMENTS = ["Verified on latest build", "See attached log", "Crash on start, see defect",
+                  "Works as expected", "Timeout after 30s"]
+TESTERS = ["alice", "bob", "carol", "dave", "erin"]
+
+# Format of the benchmark output file
+RESULT_VERSION = 1
+
+
+def generate_run(file_path, rows, run_index, overlap=0.8, failed=0.2, passed=0.7, minor=0.05, seed=0):
+    """
+    Write one synthetic TestRail export.
+
+    Parameters:
+    - file_path: Path of the CSV file to write
+    - rows: Number of tests in the run
+    - run_index: Index of the run; tests and run-specific cases get IDs unique to it
+    - overlap: Share of the tests whose case also appears in other runs (0 to 1)
+    - failed: Share of failed tests
+    - passed: Share of passed tests (the rest is spread over retest/blocked/untested)
+    - minor: Share of tests with a minor/bypass comment
+    - seed: Random seed; the same arguments always produce the same file
+    """
+    rng = np.random.default_rng([seed, run_index])
+
+    # Shared cases come from one pool common to every run, the others are unique to this run
+    shared = rng.random(rows) < overlap
+    case_numbers = np.empty(rows, dtype=np.int64)
+    case_numbers[shared] = rng.choice(rows, size=int(shared.sum()), replace=False) + 1
+    case_numbers[~shared] = 10_000_000 * (run_index + 1) + np.arange(int((~shared).sum()))
+
+    other = max(0.0, 1.0 - failed - passed)
+    statuses = rng.choice(["Passed", "Failed"] + OTHER_STATUSES, size=rows,
+                          p=[passed, failed] + [other / len(OTHER_STATUSES)] * len(OTHER_STATUSES))
+
+    comments = rng.choice(OTHER_COMMENTS + [""], size=rows).astype(object)
+    is_minor = rng.random(rows) < minor
+    comments[is_minor] = rng.choice(MINOR_COMMENTS, size=int(is_minor.sum()))
+
+    test_ids = 1_000_000 * (run_index + 1) + np.arange(rows)
+    df = pd.DataFrame({
+        "ID": np.char.add("T", test_ids.astype(str)),
+        "Title": np.char.add("Verify behaviour of case ", case_numbers.astype(str)),
+        "Case ID": np.char.add("C", case_numbers.astype(str)),
+        "Comment": comments,
+        "Plan": np.char.add("Regression plan ", rng.integers(1, 6, size=rows).astype(str)),
+        "Status": statuses,
+        "Tested By": rng.choice(TESTERS, size=rows),
+        "Assigned To": rng.choice(TESTERS, size=rows),
+        "Defects": np.where(statuses == "Failed", np.char.add("BUG-", rng.integers(1, 5000, size=rows).astype(str)), ""),
+        "Elapsed": np.char.add(rng.integers(1, 600, size=rows).astype(str), "s"),
+        "Priority": rng.choice(["Low", "Medium", "High", "Critical"], size=rows),
+        "Section": np.char.add("Section ", rng.integers(1, 50, size=rows).astype(str)),
+        "Type": rng.choice(["Functional", "Regression", "Smoke"], size=rows)
+    }, columns=EXPORT_COLUMNS)
+    df.to_csv(file_path, index=False)
+
+
+def generate_runs(directory, files, rows, **options):
+    """
+    Write `files` synthetic exports to a directory and return their paths and names.
+    Options are passed to generate_run.
+    """
+    file_paths = []
+    file_names = []
+    for i in range(files):
+        file_path = os.path.join(directory, f"run_{i + 1}.csv")
+        generate_run(file_path, rows, i, **options)
+        file_paths.append(file_path)
+        file_names.append(f"Run{i + 1}")
+    return file_paths, file_names
+
+
+def parse_files(file_paths, chunksize):
+    # Parsing only, as read_classified_csv reads the analysed columns
+    frames = []
+    for file_path in file_paths:
+        reader = pd.read_csv(file_path, usecols=lambda col: col in comparison.CSV_DTYPES,
+                             dtype=comparison.CSV_DTYPES, chunksize=chunksize or None)
+        chunks = [reader] if isinstance(reader, pd.DataFrame) else list(reader)
+        frames.append(comparison.concat_chunks(chunks, comparison.CSV_COLUMNS)[comparison.CSV_COLUMNS])
+    return frames
+
+
+def classify_frames(frames):
+    # Classification only, on already parsed frames (single labelling pass per file)
+    runs = []
+    for df in frames:
+        labels = comparison.classify_rows(df)
+        keep = labels.codes != 0
+        classified = df[keep].assign(Label=labels[keep])
+        runs.append({"rows": len(df), "classified": classified,
+                     "rules": comparison.rules_key(comparison.DEFAULT_RULES)})
+    return runs
+
+
+class Pipeline:
+    """
+    State shared by the benchmark stages; every stage reads the output of the previous ones.
+    """
+
+    def __init__(self, file_paths, file_names, work_dir, chunksize):
+        self.file_paths = file_paths
+        self.file_names = file_names
+        self.work_dir = work_dir
+        self.chunksize = chunksize
+        self.stem = "benchmark_result"
+
+    def parse(self):
+        self.frames = parse_files(self.file_paths, self.chunksize)
+
+    def classify(self):
+        self.runs = classify_frames(self.frames)
+        self.category_data = {category: {name: comparison.run_category(run, category)
+                                         for name, run in zip(self.file_names, self.runs)}
+                              for category in ("failed", "passed", "minor")}
+
+    def ingest(self):
+        # Parse and classify as the application does it (chunk by chunk, fused)
+        comparison_app.load_runs(self.file_paths)
+
+    def combinations(self):
+        self.comparisons = {}
+        self.group_files = {}
+        _, codes, self.membership = comparison.encode_categories(self.category_data, self.file_names)
+        for category, frames in self.category_data.items():
+            self.comparisons[category], self.group_files[category] = comparison.group_by_membership(
+                frames, self.file_names, codes[category], self.membership[category], comparison.CSV_COLUMNS)
+
+    def matrix(self):
+        self.matrix_data = comparison.create_comparison_matrix(self.membership, self.file_names)
+
+    def hyperlinks(self):
+        for frames in self.comparisons.values():
+            for df in frames.values():
+                comparison_app.create_hyperlink_for_ids(df, "ID")
+
+    def store(self):
+        row_counts = {name: run["rows"] for name, run in zip(self.file_names, self.runs)}
+        comparison_data = comparison.build_comparison_data(
+            self.file_names, self.file_paths, None, row_counts, self.category_data, self.comparisons,
+            self.group_files, self.matrix_data)
+        self.json_path = os.path.join(self.work_dir, self.stem + ".json")
+        self.tables_path = os.path.join(self.work_dir, self.stem + ".arrow")
+        result_store.write_result(self.json_path, self.tables_path, comparison_data)
+
+    def excel(self):
+        self.excel_path = os.path.join(self.work_dir, self.stem + ".xlsx")
+        workbook.write_result_workbook(self.excel_path, result_store.read_manifest(self.json_path),
+                                       self.tables_path, chunksize=self.chunksize)
+
+    def html_results(self):
+        self._get(f"/results/{self.stem}.xlsx?json_file={self.stem}.json")
+
+    def html_api(self):
+        # First page of every table, as the results page loads them
+        manifest = result_store.read_manifest(self.json_path)
+        for section, tables in manifest["tables"].items():
+            for name in tables:
+                self._get(f"/api/results/{self.stem}/{section}/{name}")
+
+    def html_direct(self):
+        self._get(f"/direct-results/{self.stem}.xlsx")
+
+    def _get(self, url):
+        # Uncached request against the stored benchmark result
+        comparison_app.load_result_manifest.cache_clear()
+        comparison_app.load_result_table.cache_clear()
+        config = comparison_app.app.config
+        saved = (comparison_app.result_cache, comparison_app.artifact_store, config['STORE_RESULT_PAGES'])
+        # The routes read the benchmark result from the work directory and record its use there;
+        # pages are rendered on every repeat, never sent from a stored copy
+        comparison_app.result_cache = cache.DiskLRUCache(self.work_dir, 0)
+        upload_folder = os.path.join(self.work_dir, "uploads")
+        os.makedirs(upload_folder, exist_ok=True)
+        comparison_app.artifact_store = storage.StorageManager(self.work_dir, upload_folder,
+                                                               os.path.join(self.work_dir, "artifacts.json"), 0, 0)
+        config['STORE_RESULT_PAGES'] = False
+        try:
+            response = comparison_app.app.test_client().get(url)
+            # Streamed pages are rendered while the body is read
+            response.get_data()
+        finally:
+            comparison_app.result_cache, comparison_app.artifact_store, config['STORE_RESULT_PAGES'] = saved
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+
+
+# Stages in the order they run; each one needs the previous ones
+STAGES = ["parse", "classify", "ingest", "combinations", "matrix", "hyperlinks", "store", "excel",
+          "html_results", "html_api", "html_direct"]
+
+
+def run_stages(pipeline, stages, repeat):
+    """
+    Time every selected stage `repeat` times, then run it once more under tracemalloc for its
+    peak memory. Memory is measured in a separate run so tracing does not distort the timings.
+    Stages that are not selected but needed by a later selected stage run once, untimed.
+    """
+    last = max(STAGES.index(stage) for stage in stages)
+    results = {}
+    for stage in STAGES[:last + 1]:
+        func = getattr(pipeline, stage)
+        if stage not in stages:
+            func()
+            continue
+
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+
+        arrow_before = pa.total_allocated_bytes()
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[stage] = {
+            "seconds": seconds,
+            "min_seconds": min(seconds),
+            "median_seconds": statistics.median(seconds),
+            "peak_bytes": peak,
+            "arrow_bytes": max(0, pa.total_allocated_bytes() - arrow_before)
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(previous, current):
+    """
+    Return lines comparing the minimum time of every stage with a previous benchmark file.
+    """
+    lines = [f"{'stage':<14}{'before':>12}{'after':>12}{'change':>10}"]
+    for stage, result in current["stages"].items():
+        before = previous.get("stages", {}).get(stage)
+        if before is None:
+            lines.append(f"{stage:<14}{'-':>12}{result['min_seconds']:>12.4f}{'new':>10}")
+            continue
+        change = (result["min_seconds"] / before["min_seconds"] - 1) * 100 if before["min_seconds"] else 0
+        lines.append(f"{stage:<14}{before['min_seconds']:>12.4f}{result['min_seconds']:>12.4f}{change:>+9.1f}%")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CSV comparison pipeline on synthetic TestRail exports")
+    parser.add_argument("--rows", type=int, default=10000, help="Tests per run")
+    parser.add_argument("--files", type=int, default=4, help="Number of runs")
+    parser.add_argument("--overlap", type=float, default=0.8, help="Share of cases shared between runs")
+    parser.add_argument("--failed", type=float, default=0.2, help="Share of failed tests")
+    parser.add_argument("--passed", type=float, default=0.7, help="Share of passed tests")
+    parser.add_argument("--minor", type=float, default=0.05, help="Share of minor/bypass comments")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="Comma separated stages to run, in pipeline order (default: all)")
+    parser.add_argument("--chunk-size", type=int, default=comparison_app.app.config['CSV_CHUNK_SIZE'],
+                        help="Rows read at a time from the CSV files")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="Previous benchmark JSON file to compare with")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files")
+    args = parser.parse_args(argv)
+
+    stages = [stage for stage in STAGES if stage in args.stages.split(",")]
+    if not stages:
+        parser.error(f"--stages must name at least one of {', '.join(STAGES)}")
+    work_dir = tempfile.mkdtemp(prefix="csv-comparison-benchmark-")
+    try:
+        start = time.perf_counter()
+        file_paths, file_names = generate_runs(work_dir, args.files, args.rows, overlap=args.overlap,
+                                               failed=args.failed, passed=args.passed, minor=args.minor,
+                                               seed=args.seed)
+        generate_seconds = time.perf_counter() - start
+
+        pipeline = Pipeline(file_paths, file_names, work_dir, args.chunk_size)
+        stage_results = run_stages(pipeline, stages, args.repeat)
+
+        output = {
+            "version": RESULT_VERSION,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "parameters": {key: value for key, value in vars(args).items()
+                           if key not in ("output", "compare", "keep", "stages")},
+            "environment": {
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "numpy": np.__version__,
+                "pyarrow": pa.__version__,
+                "cpu_count": os.cpu_count()
+            },
+            "input_bytes": sum(os.path.getsize(path) for path in file_paths),
+            "generate_seconds": generate_seconds,
+            "stages": stage_results
+        }
+    finally:
+        if args.keep:
+            print(f"Generated files kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+
+    print(f"{'stage':<14}{'min s':>10}{'median s':>10}{'peak MB':>10}")
+    for stage, result in stage_results.items():
+        print(f"{stage:<14}{result['min_seconds']:>10.4f}{result['median_seconds']:>10.4f}"
+              f"{result['peak_bytes'] / 1024 / 1024:>10.1f}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print()
+        print("\n".join(compare_results(previous, output)))
+
+
+if __name__ == "__main__":
+    main()
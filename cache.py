@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """
+    Return the SHA-256 hex digest of a file's bytes.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_digest(source):
+    """
+    Return the SHA-256 hex digest of a CSV source: a file path, or the contents as bytes.
+    """
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    return file_digest(source)
+
+
+def result_key(file_digests, file_names, rules=None):
+    """
+    Build the cache key of a comparison from the uploaded file digests, the ordered file names
+    and the key of the classification rules (see comparison.rules_key).
+    """
+    payload = json.dumps([list(file_digests), list(file_names), rules])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class DiskLRUCache:
+    """
+    Size-capped cache of files in a single directory.
+
+    Files sharing the same stem (name without extension) form one entry and are evicted
+    together, e.g. the .xlsx and .json of one comparison. Recency is tracked through the
+    file modification time, which is refreshed on every hit.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def temp_path(self, filename):
+        """
+        Path to write an entry file to before moving it in place with os.replace.
+        Every call returns a new name, so writers of the same entry never share a temporary
+        file. Temporary files are never evicted.
+        """
+        stem, ext = os.path.splitext(filename)
+        return os.path.join(self.directory, f"{stem}.{uuid.uuid4().hex}.tmp{ext}")
+
+    def lookup(self, stem, suffixes):
+        """
+        Return True if every file of the entry exists, marking it as recently used.
+
+        Parameters:
+        - stem: Entry name shared by all its files
+        - suffixes: File extensions making up a complete entry (e.g. ['.xlsx', '.json'])
+        """
+        paths = [self.path(stem + suffix) for suffix in suffixes]
+        if not all(os.path.exists(p) for p in paths):
+            return False
+        self.touch(stem, suffixes)
+        return True
+
+    def touch(self, stem, suffixes):
+        now = time.time()
+        for suffix in suffixes:
+            try:
+                os.utime(self.path(stem + suffix), (now, now))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, keep=()):
+        """
+        Remove least recently used entries until the directory fits in max_bytes.
+
+        Parameters:
+        - keep: Entry stems that must not be evicted (e.g. the entry just written)
+        """
+        if not self.max_bytes:
+            return
+
+        with self._lock:
+            entries = {}
+            for entry in os.scandir(self.directory):
+                stem = os.path.splitext(entry.name)[0]
+                if not entry.is_file() or stem.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process since the directory was listed
+                    continue
+                size, last_used, paths = entries.get(stem, (0, 0, []))
+                entries[stem] = (size + stat.st_size, max(last_used, stat.st_mtime), paths + [entry.path])
+
+            total = sum(size for size, _, _ in entries.values())
+            for stem, (size, _, paths) in sorted(entries.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                if stem in keep:
+                    continue
+                for p in paths:
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+                total -= size
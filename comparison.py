@@ -0,0 +1,728 @@
+import hashlib
+import io
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import cache
+import metrics
+import result_store
+
+# Columns used by the analysis and the dtypes they are read with
+CSV_COLUMNS = ["ID", "Title", "Case ID", "Comment", "Plan", "Status", "Tested By"]
+CSV_DTYPES = {
+    "ID": str,
+    "Title": str,
+    "Case ID": "category",
+    "Comment": str,
+    "Plan": "category",
+    "Status": "category",
+    "Tested By": "category"
+}
+
+
+# Default classification rules. Status values are compared case-insensitively; a row is
+# "minor" when its comment has one of the keywords at the start of a word. "plans" maps a
+# Plan name to its own "statuses" and/or "minor_keywords", used for the rows of that plan.
+DEFAULT_RULES = {
+    "statuses": {"passed": ["passed"], "failed": ["failed"]},
+    "minor_keywords": ["minor", "bypass"],
+    "plans": {}
+}
+
+# Row labels: the status class, plus "_minor" when the comment matches a minor keyword.
+# The category code of a label is status class index + 3 * minor.
+STATUS_CLASSES = ["other", "passed", "failed"]
+LABELS = STATUS_CLASSES + [f"{status}_minor" for status in STATUS_CLASSES]
+LABEL_DTYPE = pd.CategoricalDtype(LABELS)
+
+
+def load_rules(rules_path=None):
+    """
+    Read classification rules from a JSON file, falling back to DEFAULT_RULES for the keys
+    it leaves out; "statuses" are merged by status class, so a file listing only failed
+    statuses keeps the default passed ones. Without a path the default rules are returned.
+
+    Parameters:
+    - rules_path: Optional path to a JSON file with "statuses", "minor_keywords" and "plans"
+    """
+    rules = json.loads(json.dumps(DEFAULT_RULES))
+    if rules_path:
+        with open(rules_path) as f:
+            loaded = json.load(f)
+        rules["statuses"].update(loaded.pop("statuses", {}))
+        rules.update(loaded)
+
+    for scope, scope_rules in [("rules", rules)] + [(f"plan {plan}", plan_rules)
+                                                    for plan, plan_rules in rules["plans"].items()]:
+        unknown = set(scope_rules.get("statuses", {})) - set(STATUS_CLASSES[1:])
+        if unknown:
+            raise ValueError(f"Unknown status class in {scope}: {', '.join(sorted(unknown))} "
+                             f"(statuses map 'passed' or 'failed' to a list of Status values)")
+    return rules
+
+
+def rules_key(rules):
+    """
+    Short hash of classification rules, part of the cache keys of parsed runs and results.
+    """
+    payload = json.dumps(rules, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def status_classes(status, statuses):
+    """
+    Status class index (see STATUS_CLASSES) of every row. A categorical column is mapped
+    through its categories, so each distinct value is lowercased once.
+    """
+    lookup = {value.lower(): STATUS_CLASSES.index(status_class)
+              for status_class, values in statuses.items() for value in values}
+    if isinstance(status.dtype, pd.CategoricalDtype):
+        # The extra last entry is the class of missing values (code -1)
+        category_classes = [lookup.get(str(value).lower(), 0) for value in status.cat.categories] + [0]
+        return np.array(category_classes, dtype=np.int8)[status.cat.codes.to_numpy()]
+    return status.str.lower().map(lookup).fillna(0).to_numpy(dtype=np.int8)
+
+
+def minor_mask(comment, keywords):
+    """Rows whose comment has one of the keywords at the start of a word"""
+    if not keywords:
+        return np.zeros(len(comment), dtype=bool)
+    pattern = r"(?i)\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + ")"
+    return comment.str.contains(pattern, na=False).to_numpy(dtype=bool)
+
+
+def classify_rows(df, rules=None):
+    """
+    Label every row of a DataFrame in one pass: one lookup over the Status categories and
+    one scan of the comments (plus one per Plan with its own rules).
+    Returns a categorical array of LABELS.
+
+    Parameters:
+    - df: DataFrame with the Status, Comment and Plan columns
+    - rules: Classification rules (see load_rules), DEFAULT_RULES if None.
+      Per-plan "statuses" are merged into the top-level ones by status class.
+    """
+    rules = rules or DEFAULT_RULES
+    codes = status_classes(df["Status"], rules["statuses"])
+    minor = minor_mask(df["Comment"], rules["minor_keywords"])
+
+    for plan, plan_rules in rules["plans"].items():
+        in_plan = (df["Plan"] == plan).to_numpy(dtype=bool)
+        if not in_plan.any():
+            continue
+        if "statuses" in plan_rules:
+            statuses = {**rules["statuses"], **plan_rules["statuses"]}
+            codes[in_plan] = status_classes(df["Status"][in_plan], statuses)
+        if "minor_keywords" in plan_rules:
+            minor[in_plan] = minor_mask(df["Comment"][in_plan], plan_rules["minor_keywords"])
+
+    return pd.Categorical.from_codes(codes + 3 * minor, dtype=LABEL_DTYPE)
+
+
+def category_mask(labels, category):
+    """
+    Rows of a label column in one category: "passed", "failed" or "minor".
+    """
+    codes = labels.cat.codes.to_numpy()
+    if category == "minor":
+        return codes >= 3
+    return codes % 3 == STATUS_CLASSES.index(category)
+
+
+def run_category(run, category):
+    """
+    Rows of a classified run in one category: the classified frame and the positions of the
+    rows in it, in file order. No rows are copied; see take_rows.
+    """
+    frame = run["classified"]
+    return frame, np.flatnonzero(category_mask(frame["Label"], category))
+
+
+def stored_category(table):
+    """
+    A stored table as category rows (see run_category): all of its rows, as they are.
+    The table is a DataFrame or an Arrow record batch (see result_store.read_batch).
+    """
+    return table, None
+
+
+def take_rows(frame, rows, columns):
+    """
+    Copy of some rows and columns of a DataFrame, made in one step. Category rows of a
+    stored table (rows None, see stored_category) are the table itself.
+    """
+    if rows is None:
+        return frame
+    return frame.iloc[rows, frame.columns.get_indexer(columns)]
+
+
+def concat_chunks(frames, columns):
+    """
+    Concatenate DataFrame chunks, keeping categorical columns categorical.
+    Chunks are read separately, so their categories are merged before concatenating.
+    """
+    if not frames:
+        return pd.DataFrame({col: pd.Series(dtype=CSV_DTYPES.get(col, object)) for col in columns})
+
+    dtypes = {}
+    for col in columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([frame[col] for frame in frames]).categories
+            dtypes[col] = pd.CategoricalDtype(categories)
+    return pd.concat([frame.astype(dtypes) for frame in frames])
+
+
+def read_classified_csv(file_path, chunksize=None, rules=None):
+    """
+    Read a TestRail CSV export in chunks and label each chunk as it is read (see classify_rows).
+    Only the analysed columns are parsed, with explicit dtypes, and only the rows in at least
+    one category are kept, once, so memory stays bounded by the chunk size plus the results.
+
+    Parameters:
+    - file_path: Path to the CSV file, or its contents as bytes
+    - chunksize: Number of rows per chunk (None reads the file at once)
+    - rules: Classification rules (see load_rules), DEFAULT_RULES if None
+
+    Returns:
+    - Dictionary with the total number of "rows", the "classified" DataFrame (the analysed
+      columns plus a categorical "Label" column, see run_category) and the "rules" key
+      (see rules_key)
+    """
+    if isinstance(file_path, bytes):
+        file_path = io.BytesIO(file_path)
+    reader = pd.read_csv(file_path, usecols=lambda col: col in CSV_DTYPES, dtype=CSV_DTYPES,
+                         chunksize=chunksize or None)
+    chunks = [reader] if isinstance(reader, pd.DataFrame) else reader
+
+    rows = 0
+    parts = []
+    for chunk in chunks:
+        missing = [col for col in CSV_COLUMNS if col not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+        rows += len(chunk)
+        labels = classify_rows(chunk, rules)
+        # Code 0 is "other" without a minor comment: in no category
+        keep = labels.codes != 0
+        parts.append(chunk[keep][CSV_COLUMNS].assign(Label=labels[keep]))
+
+    classified = concat_chunks(parts, CSV_COLUMNS + ["Label"])
+    classified["Label"] = classified["Label"].astype(LABEL_DTYPE)
+    return {"rows": rows, "classified": classified, "rules": rules_key(rules or DEFAULT_RULES)}
+
+
+def compare_runs(runs, file_names, file_paths, file_digests=None, progress=None):
+    """
+    Compare the test cases of classified runs (see read_classified_csv).
+    Returns the comparison data stored by result_store.write_result.
+
+    Parameters:
+    - runs: List of classified runs, one per file
+    - file_names: List of names for the CSV files
+    - file_paths: List of paths to the CSV files (None for files whose raw CSV was not kept)
+    - file_digests: Optional SHA-256 digests of the CSV files, stored with the result
+    - progress: Optional callback(stage, percent) used to report job progress
+    """
+    def report(stage, done, total):
+        if progress:
+            progress(stage, 100 * done // max(total, 1))
+
+    # Columns to include in the output
+    columns = CSV_COLUMNS
+
+    metrics.observe_input(sum(run["rows"] for run in runs), len(runs))
+    rules = {run["rules"] for run in runs}
+    if len(rules) > 1:
+        raise ValueError("The runs were classified with different rules")
+
+    # Rows of every category of every file; tables are only copied out when they are stored
+    row_counts = {}
+    category_data = {"failed": {}, "passed": {}, "minor": {}}
+
+    for i, (file_name, run) in enumerate(zip(file_names, runs)):
+        report("classify", i, len(runs))
+        row_counts[file_name] = run["rows"]
+        for category, frames in category_data.items():
+            frames[file_name] = run_category(run, category)
+
+    # Group cases by which files they appear in (one membership bitmap per category, over
+    # Case ID codes shared by every file and category)
+    comparisons = {}
+    group_files = {}
+    with metrics.stage("combinations"):
+        dictionary, codes, membership = encode_categories(category_data, file_names)
+        for i, (category, frames) in enumerate(category_data.items()):
+            report("compare", i, len(category_data))
+            comparisons[category], group_files[category] = group_by_membership(
+                frames, file_names, codes[category], membership[category], columns)
+
+    # Create comparison matrix
+    with metrics.stage("matrix"):
+        matrix_data = create_comparison_matrix(membership, file_names)
+
+    report("json", 0, 1)
+    return build_comparison_data(file_names, file_paths, file_digests, row_counts, category_data,
+                                 comparisons, group_files, matrix_data, rules.pop() if rules else None,
+                                 {"dictionary": dictionary, "membership": membership})
+
+
+def build_comparison_data(file_names, file_paths, file_digests, row_counts, category_data,
+                          comparisons, group_files, matrix_data, rules=None, case_index=None):
+    """
+    Assemble the comparison data dictionary stored by result_store.write_result.
+
+    Parameters:
+    - file_names: List of file names, in upload order
+    - file_paths: List of paths to the CSV files (None for files whose raw CSV was not kept)
+    - file_digests: SHA-256 digests of the CSV files, or None if unknown
+    - row_counts: Dictionary of file name -> total number of rows
+    - category_data: Dictionary of category -> file name -> category rows (see run_category
+      and stored_category)
+    - comparisons: Dictionary of category -> comparison name -> DataFrame (or stored table)
+    - group_files: Dictionary of category -> comparison name -> indices of the files it covers
+    - matrix_data: Records from create_comparison_matrix
+    - rules: Key of the classification rules the runs were classified with (see rules_key)
+    - case_index: Optional dictionary with the Case ID "dictionary" and the "membership"
+      bitmaps (see encode_categories), stored with the result for extend_comparison
+    """
+    columns = CSV_COLUMNS
+
+    # Prepare data for all files (raw IDs; links are added when the tables are served)
+    all_data_web = {}
+    for file_name in file_names:
+        for category in ("failed", "passed", "minor"):
+            all_data_web[f"all_{category}_{file_name}"] = take_rows(*category_data[category][file_name], columns)
+
+    # Generate summary statistics
+    summary = {}
+
+    # Add file counts
+    for file_name in file_names:
+        summary[f"Total cases in {file_name}"] = row_counts[file_name]
+        summary[f"Failed cases in {file_name}"] = len(all_data_web[f"all_failed_{file_name}"])
+        summary[f"Passed cases in {file_name}"] = len(all_data_web[f"all_passed_{file_name}"])
+        summary[f"Minor cases in {file_name}"] = len(all_data_web[f"all_minor_{file_name}"])
+
+    # Add comparison counts
+    for category, category_comparisons in comparisons.items():
+        for name, df in category_comparisons.items():
+            summary[f"{category.capitalize()} in {name}"] = len(df)
+
+    # Create a dictionary with all comparison data (tables stay DataFrames, see result_store).
+    # The digests and the files behind each comparison let add_run_to_comparison extend it later.
+    comparison_data = {
+        "summary": summary,
+        "file_names": file_names,
+        "file_count": len(file_names),
+        "matrix": matrix_data,
+        "source_files": [path and os.path.abspath(path) for path in file_paths],
+        "file_digests": list(file_digests) if file_digests else None,
+        "groups": group_files,
+        "classification_rules": rules,
+        "failed_comparisons": comparisons["failed"],
+        "passed_comparisons": comparisons["passed"],
+        "minor_comparisons": comparisons["minor"],
+        "all_data": all_data_web,
+        result_store.CASE_INDEX: case_index
+    }
+
+    return comparison_data
+
+
+def check_extendable(manifest, file_name, rules=None):
+    """
+    Raise ValueError if a stored comparison cannot be extended with a file of this name,
+    or (when `rules`, a rules_key, is given) with a file classified by these rules.
+    """
+    if not manifest.get("groups") or not manifest.get("file_digests"):
+        raise ValueError("This result was stored before runs could be added; compare all files again instead")
+    if file_name in manifest["file_names"]:
+        raise ValueError(f"The comparison already has a file named {file_name}")
+    # Results stored before the rules were configurable used the default rules
+    if rules is not None and manifest.get("classification_rules", rules_key(DEFAULT_RULES)) != rules:
+        raise ValueError("This result was classified with other rules; compare all files again instead")
+
+
+def extend_comparison(manifest, tables_path, run, file_path, file_name, file_digest=None, progress=None,
+                      cases_path=None):
+    """
+    Extend a stored comparison with one more classified run, without the earlier files' CSVs.
+
+    The Case ID dictionary and membership bitmaps stored with the result get the new file's
+    cases and one bitmap column per category; the earlier files are not encoded again. Stored
+    groups without a case of the new file are copied to the new result as they are, the others
+    are split by whether their cases appear in the new file, the new file's remaining cases
+    form "<new>_only", and only the matrix pairs involving the new file are computed. The
+    result is the same as a full comparison of all the files.
+
+    Parameters:
+    - manifest: Manifest of the stored comparison (see result_store)
+    - tables_path: Path to the Arrow file with the stored tables
+    - run: Classified run of the new file (see read_classified_csv)
+    - file_path: Path to the new CSV file (None if its raw CSV was not kept)
+    - file_name: Name of the new file (checked with check_extendable by the caller, against
+      the rules the run was classified with)
+    - file_digest: Optional SHA-256 digest of the new file
+    - progress: Optional callback(stage, percent) used to report job progress
+    - cases_path: Path to the case index stored with the result (see result_store.write_case_index);
+      when there is none, e.g. for results stored before it was kept, it is rebuilt from the tables
+    """
+    def report(stage, done, total):
+        if progress:
+            progress(stage, 100 * done // max(total, 1))
+
+    def stored_table(section, name):
+        return result_store.read_table(tables_path, manifest["tables"][section][name]["batch"])
+
+    def stored_batch(section, name):
+        return result_store.read_batch(tables_path, manifest["tables"][section][name]["batch"])
+
+    columns = CSV_COLUMNS
+    old_names = manifest["file_names"]
+    new_index = len(old_names)
+    file_names = old_names + [file_name]
+
+    # The earlier files' tables are stored again as they are
+    report("classify", 0, 1)
+    row_counts = {name: manifest["summary"][f"Total cases in {name}"] for name in old_names}
+    row_counts[file_name] = run["rows"]
+    metrics.observe_input(sum(row_counts.values()), len(file_names))
+    category_data = {category: {} for category in ("failed", "passed", "minor")}
+    with metrics.stage("stored"):
+        if cases_path and os.path.exists(cases_path):
+            dictionary, membership = result_store.read_case_index(cases_path)
+        else:
+            stored = {category: {name: stored_category(stored_table("all_data", f"all_{category}_{name}"))
+                                 for name in old_names}
+                      for category in category_data}
+            dictionary, _, membership = encode_categories(stored, old_names)
+        for category, frames in category_data.items():
+            for name in old_names:
+                frames[name] = stored_category(stored_batch("all_data", f"all_{category}_{name}"))
+            frames[file_name] = run_category(run, category)
+
+    comparisons = {}
+    group_files = {}
+    with metrics.stage("combinations"):
+        dictionary, codes, membership = add_to_case_index(
+            dictionary, membership, {category: frames[file_name] for category, frames in category_data.items()})
+        for i, category in enumerate(category_data):
+            report("compare", i, len(category_data))
+            new_frame, new_rows = category_data[category][file_name]
+            new_codes = codes[category]
+            bitmap = membership[category]
+            section = f"{category}_comparisons"
+
+            # Stored groups with cases of the new file, by the bitmask of their files
+            in_old = bitmap[new_codes, :new_index].any(axis=1)
+            touched = set(membership_combinations(bitmap[new_codes[in_old], :new_index])[1])
+
+            only = {}
+            combos = {}
+            for name, files in manifest["groups"][category].items():
+                if name == "all_files":
+                    # Same rows as the combination of every file, rebuilt below
+                    continue
+                mask = sum(1 << index for index in files)
+                if mask not in touched:
+                    if len(files) == 1:
+                        only[files[0]] = stored_batch(section, name)
+                    else:
+                        combos[mask] = stored_batch(section, name)
+                    continue
+                df = stored_table(section, name)
+                in_new = bitmap[encode_case_ids(df["Case ID"], dictionary), new_index]
+                if len(files) == 1:
+                    only[files[0]] = df[~in_new][columns]
+                elif not in_new.all():
+                    combos[mask] = df[~in_new][columns]
+                combos[mask | 1 << new_index] = df[in_new][columns]
+
+            # Cases of the new file that no earlier file has
+            only[new_index] = take_rows(new_frame, new_rows[~in_old], columns)
+
+            comparisons[category], group_files[category] = assemble_groups(only, combos, file_names)
+
+    # Only the pairs with the new file are new; keep every File 1 block in order
+    with metrics.stage("matrix"):
+        new_pairs = create_comparison_matrix(membership, file_names, pairs_with=new_index)
+    matrix_data = []
+    for i, name in enumerate(old_names):
+        matrix_data.extend(row for row in manifest["matrix"] if row["File 1"] == name)
+        matrix_data.append(new_pairs[i])
+
+    report("json", 0, 1)
+    return build_comparison_data(file_names, manifest["source_files"] + [file_path],
+                                 manifest["file_digests"] + [file_digest or cache.file_digest(file_path)],
+                                 row_counts, category_data, comparisons, group_files, matrix_data, run["rules"],
+                                 {"dictionary": dictionary, "membership": membership})
+
+
+def case_id_values(values):
+    """
+    Case IDs as an object array with every missing value as NaN. Parsed runs have NaN for
+    blank Case IDs while tables read back from a result have None; both are the same case.
+    """
+    values = np.array(values, dtype=object)
+    values[pd.isna(values)] = np.nan
+    return values
+
+
+def build_case_dictionary(columns):
+    """
+    Shared dictionary of Case IDs: every distinct value of the given Case ID columns, once.
+    The position of a Case ID in the dictionary is its integer code (see encode_case_ids).
+    Missing Case IDs all share one code.
+    """
+    uniques = [case_id_values(column.unique()) for column in columns]
+    return pd.Index(np.concatenate(uniques) if uniques else [], dtype=object).unique()
+
+
+def encode_case_ids(column, dictionary):
+    """
+    Integer codes of a Case ID column in a shared dictionary (-1 for values not in it).
+    A categorical column is encoded through its categories, so every distinct value is
+    looked up once and the rows are mapped with an integer take.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # The extra last entry is the code of missing values (category code -1)
+        category_codes = np.append(dictionary.get_indexer(column.cat.categories.astype(object)),
+                                   dictionary.get_indexer([np.nan]))
+        return category_codes[column.cat.codes.to_numpy()]
+    return dictionary.get_indexer(case_id_values(column))
+
+
+def encode_categories(category_data, file_names):
+    """
+    Encode the Case IDs of every file and category with one shared dictionary and record
+    which files each case appears in as a bitmap per category.
+
+    Parameters:
+    - category_data: Dictionary of category -> file name -> category rows (see run_category)
+    - file_names: List of file names (bitmap columns, in order)
+
+    Returns:
+    - The shared dictionary (see build_case_dictionary)
+    - Dictionary of category -> file name -> Case ID code of every row
+    - Dictionary of category -> bool array of shape (cases, files), True where the case
+      appears in the file
+    """
+    case_ids = {category: {file_name: category_case_ids(*frames[file_name]) for file_name in file_names}
+                for category, frames in category_data.items()}
+    dictionary = build_case_dictionary([columns[file_name]
+                                        for columns in case_ids.values() for file_name in file_names])
+    codes = {}
+    membership = {}
+    for category, columns in case_ids.items():
+        codes[category] = {}
+        bitmap = np.zeros((len(dictionary), len(file_names)), dtype=bool)
+        for j, file_name in enumerate(file_names):
+            codes[category][file_name] = encode_case_ids(columns[file_name], dictionary)
+            bitmap[codes[category][file_name], j] = True
+        membership[category] = bitmap
+    return dictionary, codes, membership
+
+
+def category_case_ids(frame, rows):
+    """
+    Case ID column of category rows (see run_category).
+    """
+    return frame["Case ID"] if rows is None else frame["Case ID"].iloc[rows]
+
+
+def add_to_case_index(dictionary, membership, new_rows):
+    """
+    Add one file to a Case ID dictionary and its membership bitmaps (see encode_categories).
+    Only the new file is encoded: its unknown Case IDs are appended to the dictionary, so the
+    codes of the earlier files stay valid, and every bitmap gets one more column.
+
+    Parameters:
+    - dictionary: Shared Case ID dictionary of the earlier files
+    - membership: Dictionary of category -> bitmap of the earlier files
+    - new_rows: Dictionary of category -> category rows of the new file (see run_category)
+
+    Returns:
+    - The extended dictionary, the Case ID codes of the new file's rows by category and the
+      extended membership bitmaps by category
+    """
+    case_ids = {category: category_case_ids(*rows) for category, rows in new_rows.items()}
+    new_ids = build_case_dictionary(case_ids.values())
+    dictionary = dictionary.append(new_ids[dictionary.get_indexer(new_ids) == -1])
+
+    codes = {}
+    extended = {}
+    for category, bitmap in membership.items():
+        codes[category] = encode_case_ids(case_ids[category], dictionary)
+        extended[category] = np.zeros((len(dictionary), bitmap.shape[1] + 1), dtype=bool)
+        extended[category][:len(bitmap), :-1] = bitmap
+        extended[category][codes[category], -1] = True
+    return dictionary, codes, extended
+
+
+def membership_combinations(bitmap):
+    """
+    Find the file combination of every case of a membership bitmap (see encode_categories).
+
+    Returns:
+    - Array with the combination index of every case
+    - List with the bitmask of each combination, bit i set for file i (Python integers, so
+      any number of files fits)
+    """
+    packed = np.packbits(bitmap, axis=1, bitorder="little")
+    if not len(packed):
+        return np.zeros(0, dtype=np.intp), []
+    rows, inverse = np.unique(packed, axis=0, return_inverse=True)
+    return inverse.reshape(-1), [int.from_bytes(row.tobytes(), "little") for row in rows]
+
+
+def group_by_membership(category_frames, file_names, codes, bitmap, columns):
+    """
+    Split the cases of one category into comparison groups using their membership bitmap.
+    Produces the same keys as the original combination loop: "<file>_only" for every file,
+    "<a>_and_<b>..." for each non-empty file combination and "all_files".
+
+    Rows of a combination are taken from the first file of that combination.
+
+    Parameters:
+    - category_frames: Dictionary of file name -> category rows for one category (see run_category)
+    - file_names: List of file names, in upload order
+    - codes: Dictionary of file name -> Case ID code of every row (see encode_categories)
+    - bitmap: Membership bitmap of the category (see encode_categories)
+    - columns: Columns to include in the output
+
+    Returns:
+    - Dictionary of comparison name -> DataFrame and dictionary of comparison name -> file indices
+    """
+    combination, combination_masks = membership_combinations(bitmap)
+    file_counts = bitmap.sum(axis=1)
+    first_file = bitmap.argmax(axis=1)
+
+    only = {}
+    combos = {}
+    for i, file_name in enumerate(file_names):
+        frame, rows = category_frames[file_name]
+        row_codes = codes[file_name]
+
+        is_only = file_counts[row_codes] == 1
+        only[i] = take_rows(frame, rows[is_only], columns)
+
+        # Shared rows belong to the combination whose first file is this one
+        shared = (first_file[row_codes] == i) & ~is_only
+        if shared.any():
+            positions = pd.Series(rows[shared])
+            for index, group in positions.groupby(combination[row_codes[shared]], sort=False):
+                combos[combination_masks[index]] = take_rows(frame, group.to_numpy(), columns)
+
+    return assemble_groups(only, combos, file_names)
+
+
+def assemble_groups(only, combos, file_names):
+    """
+    Name and order comparison groups: "<file>_only" for every file, then the combinations by
+    number of files and file order, then "all_files" (the combination of every file).
+
+    Parameters:
+    - only: Dictionary of file index -> DataFrame of the cases found in that file only
+    - combos: Dictionary of membership bitmask -> DataFrame, for non-empty combinations
+    - file_names: List of file names, in upload order
+
+    Returns:
+    - Dictionary of comparison name -> DataFrame and dictionary of comparison name -> file indices
+    """
+    def combo_order(mask):
+        indices = tuple(i for i in range(len(file_names)) if mask >> i & 1)
+        return len(indices), indices
+
+    groups = {}
+    group_files = {}
+    for i, file_name in enumerate(file_names):
+        groups[f"{file_name}_only"] = only[i]
+        group_files[f"{file_name}_only"] = [i]
+
+    for mask in sorted(combos, key=combo_order):
+        indices = combo_order(mask)[1]
+        combo_name = "_and_".join(file_names[i] for i in indices)
+        groups[combo_name] = combos[mask]
+        group_files[combo_name] = list(indices)
+
+    full_mask = (1 << len(file_names)) - 1
+    if len(file_names) > 1 and full_mask in combos:
+        groups["all_files"] = combos[full_mask]
+        group_files["all_files"] = list(range(len(file_names)))
+
+    return groups, group_files
+
+
+def create_comparison_matrix(membership, file_names, pairs_with=None):
+    """
+    Create a matrix showing overlap of cases between files.
+
+    Every pairwise intersection comes from one matrix product per category (M.T @ M on the
+    case x file membership bitmap); unions and the overlap coefficient follow from the per
+    file counts. Status changes between two files come from products across categories,
+    e.g. passed.T @ failed counts cases passed in one file and failed in the other.
+
+    Parameters:
+    - membership: Dictionary of category -> membership bitmap (see encode_categories)
+    - file_names: List of file names
+    - pairs_with: Optional file index; only the pairs involving that file are computed
+      (used when a run is added to an existing comparison)
+
+    Returns:
+    - List of dictionaries for the comparison matrix
+    """
+    # Floats so the products below run through BLAS; counts stay exact far beyond any CSV size
+    matrices = {category: bitmap.astype(float) for category, bitmap in membership.items()}
+    size = len(file_names)
+
+    def product(left, right):
+        # left.T @ right, or only the row and column of pairs_with when set
+        if pairs_with is None:
+            return (left.T @ right).round().astype(np.int64)
+        result = np.zeros((size, size), dtype=np.int64)
+        result[:, pairs_with] = (left.T @ right[:, pairs_with]).round()
+        result[pairs_with, :] = (right.T @ left[:, pairs_with]).round()
+        return result
+
+    intersections = {}
+    counts = {}
+    for category, matrix in matrices.items():
+        intersections[category] = product(matrix, matrix)
+        counts[category] = matrix.sum(axis=0).round().astype(np.int64)
+    passed_to_failed = product(matrices["passed"], matrices["failed"])
+
+    def ratio(numerator, denominator):
+        return round(float(numerator / denominator), 3) if denominator > 0 else 0
+
+    matrix_data = []
+
+    # For each pair of files, read the overlap from the products
+    for i, file1 in enumerate(file_names):
+        for j in range(i + 1, len(file_names)):
+            if pairs_with is not None and pairs_with not in (i, j):
+                continue
+            file2 = file_names[j]
+            row = {"File 1": file1, "File 2": file2}
+            coefficients = {}
+            for category in ("failed", "passed", "minor"):
+                intersection = int(intersections[category][i, j])
+                size1, size2 = int(counts[category][i]), int(counts[category][j])
+
+                # Jaccard similarity (intersection / union) and overlap coefficient (intersection / smaller set)
+                row[f"{category.capitalize()} Overlap"] = intersection
+                row[f"{category.capitalize()} Jaccard"] = ratio(intersection, size1 + size2 - intersection)
+                coefficients[f"{category.capitalize()} Overlap Coefficient"] = ratio(intersection, min(size1, size2))
+            row.update(coefficients)
+
+            # Status changes from File 1 to File 2
+            row["Passed to Failed"] = int(passed_to_failed[i, j])
+            row["Failed to Passed"] = int(passed_to_failed[j, i])
+            matrix_data.append(row)
+
+    return matrix_data
@@ -0,0 +1,77 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip
+    brotli = None
+
+# Content codings we can produce, preferred first
+ENCODINGS = (["br"] if brotli is not None else []) + ["gzip"]
+
+# File suffix of a precompressed copy in each coding
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def choose_encoding(accept_encodings, available=None):
+    """
+    Pick the content coding for a response from the client's Accept-Encoding.
+    Returns None when the response should not be compressed.
+
+    Parameters:
+    - accept_encodings: The request's parsed Accept-Encoding (request.accept_encodings)
+    - available: Codings to choose from, preferred first (defaults to ENCODINGS)
+    """
+    best = None
+    best_quality = 0
+    for encoding in available or ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding):
+    """
+    Compress bytes with a content coding, at a fast level as responses are compressed per request.
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+def decompress(data, encoding):
+    if encoding == "br":
+        return brotli.decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+class StreamCompressor:
+    """
+    Compress a response sent in parts. Every part is flushed, so the client can decode it as
+    soon as it arrives; each flush costs a few bytes, so parts should be whole page sections.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=5)
+        elif encoding == "gzip":
+            # wbits 31: gzip container, as gzip.compress writes it
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        else:
+            raise ValueError(f"Unsupported content coding: {encoding}")
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
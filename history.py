@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import comparison
+
+# Database column of every analysed CSV column
+HISTORY_COLUMNS = {
+    "ID": "test_id",
+    "Title": "title",
+    "Case ID": "case_id",
+    "Comment": "comment",
+    "Plan": "plan",
+    "Status": "status",
+    "Tested By": "tested_by"
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    file_digest TEXT NOT NULL,
+    rules TEXT NOT NULL,
+    source_file TEXT,
+    total_rows INTEGER NOT NULL,
+    ingested REAL NOT NULL,
+    UNIQUE (file_digest, rules)
+);
+CREATE TABLE IF NOT EXISTS cases (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    row INTEGER NOT NULL,
+    test_id TEXT,
+    title TEXT,
+    case_id TEXT,
+    comment TEXT,
+    plan TEXT,
+    status TEXT,
+    tested_by TEXT,
+    outcome TEXT NOT NULL,
+    minor INTEGER NOT NULL,
+    PRIMARY KEY (run_id, row)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cases_case_id ON cases (case_id, run_id);
+CREATE INDEX IF NOT EXISTS cases_plan ON cases (plan, run_id);
+CREATE INDEX IF NOT EXISTS cases_status ON cases (status, run_id);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+@contextmanager
+def connect(db_path):
+    """
+    Open the history database, creating it on first use. Commits when the block succeeds.
+    """
+    with _init_lock:
+        if db_path not in _initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            with sqlite3.connect(db_path) as conn:
+                # WAL lets the query endpoints read while a job ingests a run
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+            _initialized.add(db_path)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys=ON")
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def ingest_run(db_path, run, name, file_digest, source_file=None):
+    """
+    Store the classified rows of a run, once: a file already stored with the same rules
+    keeps its original entry.
+
+    Parameters:
+    - db_path: Path to the history database
+    - run: Classified run (see comparison.read_classified_csv)
+    - name: Name of the run
+    - file_digest: SHA-256 digest of the CSV file
+    - source_file: Optional path of the CSV file
+
+    Returns:
+    - ID of the stored run
+    """
+    with connect(db_path) as conn:
+        existing = conn.execute("SELECT id FROM runs WHERE file_digest = ? AND rules = ?",
+                                (file_digest, run["rules"])).fetchone()
+        if existing is not None:
+            return existing["id"]
+
+        run_id = conn.execute(
+            "INSERT INTO runs (name, file_digest, rules, source_file, total_rows, ingested) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, file_digest, run["rules"], source_file and os.path.abspath(source_file), int(run["rows"]),
+             time.time())
+        ).lastrowid
+
+        frame = run["classified"]
+        codes = frame["Label"].cat.codes.to_numpy()
+        outcomes = np.array(comparison.STATUS_CLASSES, dtype=object)[codes % 3]
+        values = frame[comparison.CSV_COLUMNS].astype(object)
+        values = values.where(values.notna(), None)
+        records = zip([run_id] * len(frame), frame.index.tolist(), *(values[col].tolist() for col in values.columns),
+                      outcomes.tolist(), (codes >= 3).astype(int).tolist())
+        columns = ", ".join(HISTORY_COLUMNS[col] for col in comparison.CSV_COLUMNS)
+        conn.executemany(f"INSERT INTO cases (run_id, row, {columns}, outcome, minor) "
+                         f"VALUES ({', '.join('?' * (len(comparison.CSV_COLUMNS) + 4))})", records)
+        return run_id
+
+
+def list_runs(db_path, limit=100):
+    """
+    Most recently stored runs first.
+    """
+    with connect(db_path) as conn:
+        rows = conn.execute("SELECT id, name, file_digest, rules, source_file, total_rows, ingested "
+                            "FROM runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_runs(db_path, run_ids):
+    """
+    Stored runs by ID, in the order of run_ids. Raises KeyError for an unknown ID.
+    """
+    with connect(db_path) as conn:
+        rows = conn.execute(f"SELECT id, name, file_digest, rules, source_file, total_rows, ingested FROM runs "
+                            f"WHERE id IN ({', '.join('?' * len(run_ids))})", list(run_ids)).fetchall()
+    by_id = {row["id"]: dict(row) for row in rows}
+    missing = [run_id for run_id in run_ids if run_id not in by_id]
+    if missing:
+        raise KeyError(f"Unknown run ID: {', '.join(map(str, missing))}")
+    return [by_id[run_id] for run_id in run_ids]
+
+
+def load_run(db_path, run_id):
+    """
+    Rebuild a classified run from the store, as read_classified_csv returns it.
+    """
+    columns = ", ".join(HISTORY_COLUMNS[col] for col in comparison.CSV_COLUMNS)
+    with connect(db_path) as conn:
+        info = conn.execute("SELECT total_rows, rules FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if info is None:
+            raise KeyError(f"Unknown run ID: {run_id}")
+        frame = pd.read_sql_query(f"SELECT row, {columns}, outcome, minor FROM cases WHERE run_id = ? ORDER BY row",
+                                  conn, params=(run_id,), index_col="row")
+
+    codes = frame.pop("outcome").map(comparison.STATUS_CLASSES.index).to_numpy() + 3 * frame.pop("minor").to_numpy()
+    frame.columns = comparison.CSV_COLUMNS
+    frame = frame.astype({col: dtype for col, dtype in comparison.CSV_DTYPES.items() if dtype == "category"})
+    frame["Label"] = pd.Categorical.from_codes(codes.astype(np.int8), dtype=comparison.LABEL_DTYPE)
+    frame.index.name = None
+    return {"rows": info["total_rows"], "classified": frame, "rules": info["rules"]}
+
+
+def recent_runs_clause(runs, plan):
+    # Filters shared by the history queries: the last `runs` stored runs, optionally one plan
+    clause = "c.run_id IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?)"
+    params = [runs]
+    if plan:
+        clause += " AND c.plan = ?"
+        params.append(plan)
+    return clause, params
+
+
+def case_history(db_path, case_id, runs=60, plan=None):
+    """
+    Results of one case in the last `runs` stored runs, oldest first, with counts of the runs
+    it failed, passed and had a minor comment in, how often it flipped between passed and
+    failed, and the first run with a minor comment.
+
+    Parameters:
+    - db_path: Path to the history database
+    - case_id: Case ID, e.g. "C1234"
+    - runs: Number of most recent runs to look at
+    - plan: Optional Plan to restrict the history to
+    """
+    clause, params = recent_runs_clause(runs, plan)
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT r.id AS run_id, r.name AS run, r.ingested, c.test_id, c.plan, c.status, c.outcome, "
+            f"c.minor, c.comment FROM cases c JOIN runs r ON r.id = c.run_id "
+            f"WHERE c.case_id = ? AND {clause} ORDER BY c.run_id, c.row", [case_id] + params
+        ).fetchall()
+    entries = [dict(row, minor=bool(row["minor"])) for row in rows]
+
+    # One outcome per run: failed if any row of the case failed in it
+    run_outcomes = {}
+    for entry in entries:
+        if entry["outcome"] != "other":
+            previous = run_outcomes.get(entry["run_id"])
+            run_outcomes[entry["run_id"]] = "failed" if "failed" in (previous, entry["outcome"]) else "passed"
+    outcomes = list(run_outcomes.values())
+    first_minor = next((entry for entry in entries if entry["minor"]), None)
+
+    return {
+        "case_id": case_id,
+        "runs": len({entry["run_id"] for entry in entries}),
+        "failed_runs": outcomes.count("failed"),
+        "passed_runs": outcomes.count("passed"),
+        "minor_runs": len({entry["run_id"] for entry in entries if entry["minor"]}),
+        "flips": sum(a != b for a, b in zip(outcomes, outcomes[1:])),
+        "first_minor": first_minor and {key: first_minor[key] for key in ("run_id", "run", "ingested", "comment")},
+        "history": entries
+    }
+
+
+def flaky_cases(db_path, runs=60, limit=50, plan=None):
+    """
+    Cases that flipped between passed and failed most often in the last `runs` stored runs.
+
+    Parameters:
+    - db_path: Path to the history database
+    - runs: Number of most recent runs to look at
+    - limit: Maximum number of cases returned
+    - plan: Optional Plan to restrict the counts to
+    """
+    clause, params = recent_runs_clause(runs, plan)
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            f"""
+            WITH outcomes AS (
+                SELECT c.case_id, c.run_id, MAX(c.outcome = 'failed') AS failed
+                FROM cases c
+                WHERE c.outcome != 'other' AND {clause}
+                GROUP BY c.case_id, c.run_id
+            ), ordered AS (
+                SELECT case_id, failed, LAG(failed) OVER (PARTITION BY case_id ORDER BY run_id) AS previous
+                FROM outcomes
+            )
+            SELECT case_id, COUNT(*) AS runs, SUM(failed) AS failed_runs, COUNT(*) - SUM(failed) AS passed_runs,
+                   SUM(previous IS NOT NULL AND failed != previous) AS flips
+            FROM ordered
+            GROUP BY case_id
+            HAVING flips > 0
+            ORDER BY flips DESC, failed_runs DESC, case_id
+            LIMIT ?
+            """, params + [limit]
+        ).fetchall()
+    return [dict(row) for row in rows]
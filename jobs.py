@@ -0,0 +1,122 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Stages reported by comparison jobs, in the order they run
+JOB_STAGES = ["parse", "classify", "compare", "json"]
+
+# Number of finished jobs kept in memory for status polling
+MAX_FINISHED_JOBS = 200
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+_max_workers = 2
+
+
+def configure(max_workers):
+    """
+    Set the size of the worker pool. Only takes effect before the first job is submitted.
+
+    Parameters:
+    - max_workers: Maximum number of jobs running at the same time
+    """
+    global _max_workers
+    _max_workers = max(1, int(max_workers))
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="comparison-job")
+        return _executor
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def submit_job(func, *args, job_id=None, **kwargs):
+    """
+    Queue a function on the worker pool and return its job ID right away.
+    The function receives a `progress(stage, percent)` callback as keyword argument.
+
+    If a job with the same ID is still queued or running, it is reused instead of starting
+    the same work twice.
+
+    Parameters:
+    - func: Function to run
+    - job_id: Optional pre-generated job ID (e.g. when output paths depend on it)
+    """
+    job_id = job_id or new_job_id()
+    with _lock:
+        existing = _jobs.get(job_id)
+        if existing is not None and existing["status"] in ("queued", "running"):
+            return job_id
+        _jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "stage": None,
+            "percent": 0,
+            "result": None,
+            "error": None,
+            "created": time.time(),
+            "finished": None
+        }
+
+    def progress(stage, percent):
+        with _lock:
+            job = _jobs[job_id]
+            job["stage"] = stage
+            job["percent"] = int(percent)
+
+    def run():
+        with _lock:
+            _jobs[job_id]["status"] = "running"
+        try:
+            result = func(*args, progress=progress, **kwargs)
+        except Exception as e:
+            _finish(job_id, "failed", error=str(e))
+        else:
+            _finish(job_id, "done", result=result)
+
+    _get_executor().submit(run)
+    return job_id
+
+
+def _finish(job_id, status, result=None, error=None):
+    with _lock:
+        job = _jobs[job_id]
+        job["status"] = status
+        job["result"] = result
+        job["error"] = error
+        job["finished"] = time.time()
+        if status == "done":
+            job["percent"] = 100
+
+        # Forget the oldest finished jobs once there are too many
+        finished = [j for j in _jobs.values() if j["finished"] is not None]
+        if len(finished) > MAX_FINISHED_JOBS:
+            finished.sort(key=lambda j: j["finished"])
+            for old in finished[:len(finished) - MAX_FINISHED_JOBS]:
+                del _jobs[old["id"]]
+
+
+def get_job(job_id):
+    """
+    Return a snapshot of the job state, or None if the job is unknown.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def is_active(job_id):
+    """
+    Return True if the job is queued or running.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        return job is not None and job["status"] in ("queued", "running")
@@ -0,0 +1,146 @@
+import bisect
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Histogram bucket upper bounds (+Inf is implicit)
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+BYTES_BUCKETS = [2 ** power for power in range(20, 33)]  # 1MB to 4GB
+ROWS_BUCKETS = [100, 1000, 10000, 50000, 100000, 250000, 500000, 1000000, 5000000, 10000000]
+FILES_BUCKETS = [2, 3, 4, 5, 8, 10, 20, 50, 100]
+
+PREFIX = "csv_comparison"
+
+_lock = threading.Lock()
+_histograms = {}
+
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram for one metric and label set.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def observe(name, value, buckets, **labels):
+    """
+    Record one observation of a histogram metric.
+
+    Parameters:
+    - name: Metric name without the common prefix, e.g. "stage_seconds"
+    - value: Observed value
+    - buckets: Bucket upper bounds, used when the histogram is first created
+    - labels: Label values, e.g. stage="parse"
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def observe_input(rows, files):
+    """
+    Record the size of one comparison: total input rows and number of files.
+    """
+    observe("input_rows", rows, ROWS_BUCKETS)
+    observe("input_files", files, FILES_BUCKETS)
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure the wall time (and, when tracemalloc is tracing, the peak traced memory) of a
+    pipeline stage. Observations go to the stage histograms and, inside a request, to the
+    Server-Timing header of the response (see server_timing_header).
+
+    Peak memory is process wide: stages running at the same time in other threads count too.
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe("stage_seconds", seconds, SECONDS_BUCKETS, stage=name)
+        if tracing:
+            observe("stage_peak_bytes", tracemalloc.get_traced_memory()[1], BYTES_BUCKETS, stage=name)
+        # Flask is only loaded by the web app; the batch CLI never has a request context
+        flask = sys.modules.get("flask")
+        if flask is not None and flask.has_request_context():
+            flask.g.setdefault("server_timings", []).append((name, seconds))
+
+
+def server_timing_header(total_seconds=None):
+    """
+    Return the Server-Timing header value for the stages measured in the current request,
+    or None if there are none.
+
+    Parameters:
+    - total_seconds: Optional time spent handling the whole request, reported as "total"
+    """
+    from flask import g
+
+    timings = list(g.get("server_timings", []))
+    if total_seconds is not None:
+        timings.append(("total", total_seconds))
+    if not timings:
+        return None
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+
+
+def render_prometheus():
+    """
+    Render every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+
+    described = set()
+    for (name, labels), histogram in histograms:
+        metric = f"{PREFIX}_{name}"
+        if metric not in described:
+            lines.append(f"# TYPE {metric} histogram")
+            described.add(metric)
+
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+            cumulative += count
+            lines.append(f"{metric}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+        lines.append(f"{metric}_count{format_labels(labels)} {cumulative}")
+
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        lines.append(f"# TYPE {PREFIX}_process_max_rss_bytes gauge")
+        lines.append(f"{PREFIX}_process_max_rss_bytes {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}")
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
@@ -0,0 +1,166 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Sections of a comparison result holding tables (section -> table name -> DataFrame)
+TABLE_SECTIONS = ["failed_comparisons", "passed_comparisons", "minor_comparisons", "all_data"]
+
+# Key of the Case ID dictionary and membership bitmaps of a comparison (see write_case_index)
+CASE_INDEX = "case_index"
+
+
+def write_result(manifest_path, tables_path, comparison_data, cases_path=None):
+    """
+    Store a comparison result as a small JSON manifest plus one Arrow IPC file holding every table.
+
+    All tables share the same columns, so each one is written as a record batch of the same
+    Arrow file; the manifest records which batch belongs to which table. Everything that is
+    not a table (summary, file_names, matrix, ...) goes into the manifest as is. Tables given
+    as Arrow record batches (see read_batch) are written as they are.
+
+    Parameters:
+    - manifest_path: Path of the JSON manifest to write
+    - tables_path: Path of the Arrow IPC file to write
+    - comparison_data: Dictionary as returned by process_csv_files
+    - cases_path: Optional path of the Arrow IPC file to write the case index to, if the
+      comparison data has one (see write_case_index)
+    """
+    manifest = {key: value for key, value in comparison_data.items()
+                if key not in TABLE_SECTIONS and key != CASE_INDEX}
+    manifest["tables"] = {}
+
+    schema = None
+    writer = None
+    batch_index = 0
+    try:
+        for section in TABLE_SECTIONS:
+            manifest["tables"][section] = {}
+            for name, df in comparison_data.get(section, {}).items():
+                columns = df.schema.names if isinstance(df, pa.RecordBatch) else list(df.columns)
+                if schema is None:
+                    schema = pa.schema([(col, pa.string()) for col in columns])
+                    writer = pa.ipc.new_file(tables_path, schema)
+                if columns != schema.names:
+                    raise ValueError(f"Table {section}/{name} does not have the same columns as the other tables")
+
+                if isinstance(df, pa.RecordBatch):
+                    writer.write_batch(df)
+                else:
+                    # Values are stored as text (null for missing), like they are displayed
+                    arrays = [text_array(df[col]) for col in schema.names]
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+                manifest["tables"][section][name] = {"batch": batch_index, "rows": len(df)}
+                batch_index += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # No tables at all; still write an empty file so the result is complete
+        with pa.ipc.new_file(tables_path, pa.schema([])):
+            pass
+
+    if cases_path and comparison_data.get(CASE_INDEX):
+        write_case_index(cases_path, **comparison_data[CASE_INDEX])
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+
+def write_case_index(cases_path, dictionary, membership):
+    """
+    Store the Case ID dictionary and the membership bitmaps of a comparison in an Arrow IPC
+    file, so a run can be added to it later without encoding the earlier files again.
+    The file has the Case IDs (null for missing) and one bool column per category and file,
+    named "<category> <file index>".
+
+    Parameters:
+    - cases_path: Path of the Arrow IPC file to write
+    - dictionary: Shared Case ID dictionary (see comparison.build_case_dictionary)
+    - membership: Dictionary of category -> bool array of shape (cases, files)
+    """
+    columns = {"Case ID": text_array(pd.Series(dictionary, dtype=object))}
+    for category, bitmap in membership.items():
+        for index in range(bitmap.shape[1]):
+            columns[f"{category} {index}"] = pa.array(bitmap[:, index], type=pa.bool_())
+    table = pa.table(columns)
+    with pa.ipc.new_file(cases_path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_case_index(cases_path):
+    """
+    Read the Case ID dictionary and membership bitmaps written by write_case_index.
+
+    Returns:
+    - The Case ID dictionary (pandas Index, NaN for the missing Case ID)
+    - Dictionary of category -> bool array of shape (cases, files)
+    """
+    with pa.memory_map(cases_path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        case_ids = table.column("Case ID").to_numpy(zero_copy_only=False).astype(object)
+        columns = {}
+        for name in table.column_names[1:]:
+            category, index = name.rsplit(" ", 1)
+            columns.setdefault(category, {})[int(index)] = table.column(name).to_numpy(zero_copy_only=False)
+
+    case_ids[pd.isna(case_ids)] = np.nan
+    membership = {}
+    for category, bitmaps in columns.items():
+        membership[category] = np.column_stack([bitmaps[index] for index in sorted(bitmaps)]).astype(bool)
+    return pd.Index(case_ids, dtype=object), membership
+
+
+def text_array(column):
+    """
+    Convert a column to an Arrow string array, with nulls for missing values.
+    Works on a copy: astype(str) can convert an object array in place (e.g. frames loaded
+    from the parsed data cache), which would turn NaN into "nan" in the caller's frame.
+    """
+    values = pd.Series(column.to_numpy(dtype=object, copy=True))
+    missing = values.isna().to_numpy()
+    return pa.array(values.astype(str).to_numpy(), type=pa.string(), mask=missing)
+
+
+def read_manifest(manifest_path):
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def read_table(tables_path, batch_index):
+    """
+    Read a single table from the Arrow IPC file of a result, memory-mapped.
+    Only the requested record batch is materialized.
+    """
+    with pa.memory_map(tables_path, 'r') as source:
+        batch = pa.ipc.open_file(source).get_batch(batch_index)
+        return batch.to_pandas()
+
+
+def read_batch(tables_path, batch_index):
+    """
+    Read a single table from the Arrow IPC file of a result as a record batch, to store it
+    again as is (see write_result). The batch owns its data, so it outlives the file.
+    """
+    with pa.OSFile(tables_path, 'rb') as source:
+        return pa.ipc.open_file(source).get_batch(batch_index)
+
+
+def iter_table_rows(tables_path, batch_index, chunk_rows=10000):
+    """
+    Return the column names of a stored table and a generator over its rows (tuples).
+    The table is memory-mapped and converted a slice of chunk_rows at a time.
+    """
+    with pa.memory_map(tables_path, 'r') as source:
+        columns = pa.ipc.open_file(source).schema.names
+
+    def rows():
+        with pa.memory_map(tables_path, 'r') as source:
+            batch = pa.ipc.open_file(source).get_batch(batch_index)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                part = batch.slice(offset, chunk_rows)
+                yield from zip(*(column.to_pylist() for column in part.columns))
+
+    return columns, rows()
@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import uploads
+
+# Uploaded files no comparison refers to are kept this long, so files saved by a request that
+# has not registered its comparison yet are not removed under it
+ORPHAN_GRACE_SECONDS = 600
+
+# A registered comparison without result files is in progress for this long; after that its
+# job is taken to have failed without unregistering it, and its entry is evicted
+IN_PROGRESS_SECONDS = 3600
+
+# Request folders of spooled uploads (see uploads.request_folder) are removed by the job
+# that reads them; folders left this long by an interrupted process are removed
+STALE_REQUEST_SECONDS = 24 * 3600
+
+# Use of a comparison (see StorageManager.touch) is written to the index at most this often
+# per process, so a result that is read often does not rewrite the index on every request
+TOUCH_INTERVAL_SECONDS = 60
+
+
+class StorageManager:
+    """
+    Retention of comparison artifacts in the results and uploads folders.
+
+    A comparison is the unit of eviction: its files in the results folder (every file named
+    "<stem>.<anything>": manifest, tables, workbooks, stored pages, profiles) and the uploaded
+    CSV files it was computed from, as recorded in the artifact index. Evicting a comparison
+    removes its manifest first, so a result never looks complete while its other files are
+    going away, and removes an uploaded file once no remaining comparison refers to it.
+
+    Comparisons are evicted when unused for longer than ttl_seconds, then least recently used
+    first until both folders fit in max_bytes. A comparison was last used when its newest result
+    file was written or refreshed (the result cache refreshes them on every hit), or when it was
+    last served, as recorded by touch.
+    """
+
+    def __init__(self, result_folder, upload_folder, index_path, max_bytes, ttl_seconds):
+        self.result_folder = result_folder
+        self.upload_folder = upload_folder
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._touched = {}
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+    def register(self, stem, source_files):
+        """
+        Record the uploaded files a comparison is computed from. Call it before the comparison
+        is queued: a registered comparison without result files yet is in progress, and is only
+        evicted once it is older than IN_PROGRESS_SECONDS. A job that fails calls unregister.
+
+        Parameters:
+        - stem: Name of the comparison result (file name without extension)
+        - source_files: Paths of the CSV files it reads
+        """
+        with self._lock:
+            index = self._read_index()
+            entry = index.setdefault(stem, {"sources": [], "registered": time.time()})
+            entry["sources"] = sorted(set(entry["sources"]) | {os.path.abspath(path) for path in source_files if path})
+            entry["registered"] = time.time()
+            self._write_index(index)
+
+    def unregister(self, stem):
+        """
+        Forget the uploaded files of a comparison that was registered but never stored (its
+        job failed); files no other comparison refers to are removed by the next sweeps, after
+        the orphan grace period. A comparison with a stored result is left as it is.
+
+        Parameters:
+        - stem: Name of the comparison result (file name without extension)
+        """
+        with self._lock:
+            if os.path.exists(os.path.join(self.result_folder, stem + '.json')):
+                return
+            index = self._read_index()
+            if index.pop(stem, None) is not None:
+                self._write_index(index)
+
+    def touch(self, stem):
+        """
+        Record that a comparison was used: call it whenever one of its pages, tables or
+        workbooks is served, including "not modified" answers.
+
+        Parameters:
+        - stem: Name of the comparison result (file name without extension)
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(stem, 0) < TOUCH_INTERVAL_SECONDS:
+                return
+            self._touched[stem] = now
+            index = self._read_index()
+            if stem not in index:
+                # Results stored before the index existed: their sources are in the manifest
+                manifest_path = os.path.join(self.result_folder, stem + '.json')
+                index[stem] = {"sources": self._manifest_sources(manifest_path), "registered": 0}
+            index[stem]["last_used"] = now
+            self._write_index(index)
+
+    def sweep(self, keep=()):
+        """
+        Evict expired comparisons, then least recently used ones until the folders fit in
+        max_bytes, then uploaded files no comparison refers to.
+
+        Parameters:
+        - keep: Comparison stems that must not be evicted (e.g. the result just written)
+
+        Returns:
+        - Dictionary with the number of "evicted" comparisons, "removed_uploads" and the
+          "bytes" left in both folders
+        """
+        with self._lock:
+            now = time.time()
+            index = self._read_index()
+            comparisons = self._scan_results()
+
+            # Results stored before the index existed: their sources are in the manifest
+            for stem, entry in comparisons.items():
+                if stem not in index and entry["manifest"]:
+                    index[stem] = {"sources": self._manifest_sources(entry["manifest"]), "registered": 0}
+            for stem, entry in index.items():
+                comparisons.setdefault(stem, {"files": [], "size": 0, "last_used": 0, "manifest": None})
+                comparisons[stem]["last_used"] = max(comparisons[stem]["last_used"], entry["registered"],
+                                                     entry.get("last_used", 0))
+
+            uploads = self._scan_uploads()
+            total = sum(entry["size"] for entry in comparisons.values()) + sum(size for size, _ in uploads.values())
+
+            references = {}
+            for entry in index.values():
+                for path in entry["sources"]:
+                    references[path] = references.get(path, 0) + 1
+
+            evicted = 0
+            removed_uploads = 0
+            for stem in sorted(comparisons, key=lambda stem: comparisons[stem]["last_used"]):
+                entry = comparisons[stem]
+                if stem in keep:
+                    continue
+                expired = self.ttl_seconds and now - entry["last_used"] > self.ttl_seconds
+                # Comparisons still being computed only go away once expired, or abandoned by a
+                # job that never stored them
+                in_progress = not entry["files"]
+                abandoned = in_progress and now - entry["last_used"] > IN_PROGRESS_SECONDS
+                if not (expired or abandoned) and (in_progress or not self.max_bytes or total <= self.max_bytes):
+                    continue
+
+                total -= self._remove_files(entry["files"])
+                evicted += 1
+                self._touched.pop(stem, None)
+                for path in index.pop(stem, {"sources": []})["sources"]:
+                    references[path] -= 1
+                    # Only files of the uploads folder are ever removed
+                    if references[path] == 0 and path in uploads:
+                        total -= self._remove_files([path])
+                        del uploads[path]
+                        removed_uploads += 1
+
+            # Uploaded files no comparison refers to (failed uploads, replaced files)
+            for path, (size, modified) in uploads.items():
+                if not references.get(path) and now - modified > ORPHAN_GRACE_SECONDS:
+                    total -= self._remove_files([path])
+                    removed_uploads += 1
+            self._remove_stale_requests(now)
+
+            self._write_index(index)
+            return {"evicted": evicted, "removed_uploads": removed_uploads, "bytes": total}
+
+    def start_sweeper(self, interval, on_error=None):
+        """
+        Sweep every `interval` seconds in a daemon thread. Only the first call starts a thread.
+
+        Parameters:
+        - interval: Seconds between sweeps
+        - on_error: Optional callback(exception) for failed sweeps
+        """
+        with self._lock:
+            if self._sweeper is not None or interval <= 0:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.sweep()
+                    except Exception as e:
+                        if on_error:
+                            on_error(e)
+
+            self._sweeper = threading.Thread(target=run, name="storage-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _scan_results(self):
+        # Group the result files by comparison: "<stem>.json", "<stem>.sheets.xlsx", ...
+        comparisons = {}
+        for entry in os.scandir(self.result_folder):
+            if not entry.is_file() or '.tmp' in entry.name:
+                continue
+            stem = entry.name.split('.', 1)[0]
+            stat = entry.stat()
+            comparison = comparisons.setdefault(stem, {"files": [], "size": 0, "last_used": 0, "manifest": None})
+            comparison["files"].append(entry.path)
+            comparison["size"] += stat.st_size
+            comparison["last_used"] = max(comparison["last_used"], stat.st_mtime)
+            if entry.name == stem + '.json':
+                comparison["manifest"] = entry.path
+        for comparison in comparisons.values():
+            # The manifest goes first, see _remove_files
+            comparison["files"].sort(key=lambda path: path != comparison["manifest"])
+        return comparisons
+
+    def _scan_uploads(self):
+        uploads = {}
+        for entry in os.scandir(self.upload_folder):
+            if entry.is_file():
+                stat = entry.stat()
+                uploads[os.path.abspath(entry.path)] = (stat.st_size, stat.st_mtime)
+        return uploads
+
+    def _remove_stale_requests(self, now):
+        incoming = os.path.join(self.upload_folder, uploads.INCOMING_FOLDER)
+        if not os.path.isdir(incoming):
+            return
+        for entry in os.scandir(incoming):
+            if entry.is_dir() and now - entry.stat().st_mtime > STALE_REQUEST_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _manifest_sources(self, manifest_path):
+        try:
+            with open(manifest_path) as f:
+                return [os.path.abspath(path) for path in json.load(f).get("source_files", []) if path]
+        except (OSError, ValueError):
+            return []
+
+    def _remove_files(self, paths):
+        # Removed in order; returns the number of bytes freed
+        freed = 0
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)["comparisons"]
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _write_index(self, index):
+        # Several processes may write the index; each writes its own temporary file
+        temp_path = f"{self.index_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"comparisons": index}, f)
+        os.replace(temp_path, self.index_path)
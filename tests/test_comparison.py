@@ -0,0 +1,142 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import comparison  # noqa: E402
+import result_store  # noqa: E402
+
+HEADER = "ID,Title,Case ID,Comment,Plan,Status,Tested By\n"
+
+# Blank Case IDs in several files and categories: every file has some, as a failed or passed row
+FILES = {
+    "A": [("C1", "", "Passed"), ("C2", "", "Failed"), ("", "", "Failed"), ("C3", "minor issue", "Failed"),
+          ("C4", "", "Blocked")],
+    "B": [("C1", "", "Failed"), ("C2", "", "Failed"), ("", "", "Passed"), ("C5", "bypass", "Passed")],
+    "C": [("C2", "", "Failed"), ("C1", "", "Passed"), ("", "", "Failed"), ("", "", "Passed"),
+          ("C3", "minor", "Failed"), ("C6", "", "Failed")],
+    "D": [("", "", "Failed"), ("C5", "", "Passed"), ("C7", "", "Failed")],
+}
+
+
+def csv_bytes(file_name, rows):
+    lines = [f"{file_name}{i},Title {i},{case_id},{comment},P1,{status},tester\n"
+             for i, (case_id, comment, status) in enumerate(rows)]
+    return (HEADER + "".join(lines)).encode("utf-8")
+
+
+def store(tmp_path, stem, comparison_data, keep_case_index=True):
+    manifest_path = os.path.join(tmp_path, stem + ".json")
+    tables_path = os.path.join(tmp_path, stem + ".arrow")
+    cases_path = os.path.join(tmp_path, stem + ".cases.arrow") if keep_case_index else None
+    result_store.write_result(manifest_path, tables_path, comparison_data, cases_path)
+    return result_store.read_manifest(manifest_path), tables_path, cases_path
+
+
+def stored_result(manifest, tables_path):
+    """
+    Everything a result shows: the manifest without its source paths, and every table.
+    """
+    result = {key: value for key, value in manifest.items() if key not in ("tables", "source_files")}
+    for section, tables in manifest["tables"].items():
+        result[section] = {name: result_store.read_table(tables_path, table["batch"]).to_dict("list")
+                           for name, table in tables.items()}
+    return result
+
+
+@pytest.mark.parametrize("keep_case_index", [True, False])
+@pytest.mark.parametrize("start", [1, 2, 3])
+def test_extend_comparison_matches_full_compare(tmp_path, start, keep_case_index):
+    names = list(FILES)
+    runs = [comparison.read_classified_csv(csv_bytes(name, FILES[name])) for name in names]
+    digests = [f"digest-{name}" for name in names]
+
+    manifest, tables_path, _ = store(tmp_path, "full", comparison.compare_runs(runs, names, [None] * len(names),
+                                                                              digests))
+    full = stored_result(manifest, tables_path)
+
+    # Without a stored case index (results stored before it was kept) it is rebuilt from the tables
+    manifest, tables_path, cases_path = store(tmp_path, "extended", comparison.compare_runs(
+        runs[:start], names[:start], [None] * start, digests[:start]), keep_case_index)
+    for i in range(start, len(names)):
+        comparison.check_extendable(manifest, names[i], runs[i]["rules"])
+        manifest, tables_path, cases_path = store(tmp_path, f"extended{i}", comparison.extend_comparison(
+            manifest, tables_path, runs[i], None, names[i], digests[i], cases_path=cases_path), keep_case_index)
+
+    extended = stored_result(manifest, tables_path)
+    assert list(extended) == list(full)
+    for key in full:
+        assert extended[key] == full[key], key
+
+
+def test_blank_case_ids_are_one_case():
+    runs = [comparison.read_classified_csv(csv_bytes(name, FILES[name])) for name in ("A", "B")]
+    data = comparison.compare_runs(runs, ["A", "B"], [None, None])
+
+    shared = data["failed_comparisons"]["A_and_B"]
+    assert shared["Case ID"].isna().sum() == 0
+    assert data["failed_comparisons"]["A_only"]["Case ID"].isna().sum() == 1
+
+
+# Hand-checked comparison of three files; rows are (ID, Case ID, Status, Comment)
+GOLDEN_FILES = {
+    "A": [("A1", "C1", "Failed", ""), ("A2", "C2", "Failed", ""), ("A3", "C3", "Failed", ""),
+          ("A4", "C1", "Failed", ""), ("A5", "C4", "Passed", ""), ("A6", "C5", "Passed", ""),
+          ("A7", "C6", "Failed", "minor issue"), ("A8", "C7", "Untested", "")],
+    "B": [("B1", "C1", "Failed", ""), ("B2", "C2", "Failed", ""), ("B3", "C4", "Failed", ""),
+          ("B4", "C3", "Passed", ""), ("B5", "C5", "Passed", "")],
+    "C": [("c1", "C1", "Failed", ""), ("c2", "C3", "Failed", ""), ("c3", "C5", "Passed", ""),
+          ("c4", "C2", "Passed", ""), ("c5", "C4", "Passed", ""), ("c6", "C6", "Passed", "bypass")],
+}
+
+# Group -> IDs of its rows, in order; rows of a combination come from its first file
+GOLDEN_GROUPS = {
+    "failed": {"A_only": ["A7"], "B_only": ["B3"], "C_only": [], "A_and_B": ["A2"], "A_and_C": ["A3"],
+               "A_and_B_and_C": ["A1", "A4"], "all_files": ["A1", "A4"]},
+    "passed": {"A_only": [], "B_only": ["B4"], "C_only": ["c4", "c6"], "A_and_C": ["A5"],
+               "A_and_B_and_C": ["A6"], "all_files": ["A6"]},
+    "minor": {"A_only": [], "B_only": [], "C_only": [], "A_and_C": ["A7"]},
+}
+
+GOLDEN_MATRIX = [
+    {"File 1": "A", "File 2": "B",
+     "Failed Overlap": 2, "Failed Jaccard": 0.4, "Passed Overlap": 1, "Passed Jaccard": 0.333,
+     "Minor Overlap": 0, "Minor Jaccard": 0, "Failed Overlap Coefficient": 0.667,
+     "Passed Overlap Coefficient": 0.5, "Minor Overlap Coefficient": 0,
+     "Passed to Failed": 1, "Failed to Passed": 1},
+    {"File 1": "A", "File 2": "C",
+     "Failed Overlap": 2, "Failed Jaccard": 0.5, "Passed Overlap": 2, "Passed Jaccard": 0.5,
+     "Minor Overlap": 1, "Minor Jaccard": 1.0, "Failed Overlap Coefficient": 1.0,
+     "Passed Overlap Coefficient": 1.0, "Minor Overlap Coefficient": 1.0,
+     "Passed to Failed": 0, "Failed to Passed": 2},
+    {"File 1": "B", "File 2": "C",
+     "Failed Overlap": 1, "Failed Jaccard": 0.25, "Passed Overlap": 1, "Passed Jaccard": 0.2,
+     "Minor Overlap": 0, "Minor Jaccard": 0, "Failed Overlap Coefficient": 0.5,
+     "Passed Overlap Coefficient": 0.5, "Minor Overlap Coefficient": 0,
+     "Passed to Failed": 1, "Failed to Passed": 2},
+]
+
+
+def golden_csv(rows):
+    lines = [f"{test_id},Title,{case_id},{comment},P1,{status},tester\n" for test_id, case_id, status, comment in rows]
+    return (HEADER + "".join(lines)).encode("utf-8")
+
+
+def test_compare_runs_matches_hand_checked_groups_and_matrix():
+    names = list(GOLDEN_FILES)
+    runs = [comparison.read_classified_csv(golden_csv(GOLDEN_FILES[name])) for name in names]
+    data = comparison.compare_runs(runs, names, [None] * len(names))
+
+    for category, groups in GOLDEN_GROUPS.items():
+        comparisons = data[f"{category}_comparisons"]
+        assert list(comparisons) == list(groups), category
+        for name, ids in groups.items():
+            assert list(comparisons[name]["ID"]) == ids, (category, name)
+            assert list(comparisons[name].columns) == comparison.CSV_COLUMNS
+
+    assert data["matrix"] == GOLDEN_MATRIX
+    assert data["summary"]["Total cases in A"] == 8
+    assert data["summary"]["Failed cases in A"] == 5
+    assert data["summary"]["Minor cases in C"] == 1
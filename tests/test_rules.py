@@ -0,0 +1,90 @@
+import io
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+import comparison  # noqa: E402
+
+HEADER = "ID,Title,Case ID,Comment,Plan,Status,Tested By\n"
+
+
+def write_rules(tmp_path, rules):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(rules))
+    return str(path)
+
+
+def labels(rows, rules=None):
+    """
+    Labels of (plan, status, comment) rows, classified as they are read from a CSV export.
+    """
+    lines = [f"T{i},Title,C{i},{comment},{plan},{status},tester\n" for i, (plan, status, comment) in enumerate(rows)]
+    frame = pd.read_csv(io.StringIO(HEADER + "".join(lines)), dtype=comparison.CSV_DTYPES)
+    return list(comparison.classify_rows(frame, rules))
+
+
+def test_default_rules_without_a_file():
+    assert comparison.load_rules() == comparison.DEFAULT_RULES
+    assert comparison.load_rules() is not comparison.DEFAULT_RULES
+
+
+def test_partial_file_keeps_the_other_defaults(tmp_path):
+    rules = comparison.load_rules(write_rules(tmp_path, {"statuses": {"failed": ["failed", "blocked"]}}))
+
+    assert rules["statuses"] == {"passed": ["passed"], "failed": ["failed", "blocked"]}
+    assert rules["minor_keywords"] == comparison.DEFAULT_RULES["minor_keywords"]
+    assert rules["plans"] == {}
+
+
+def test_status_values_match_case_insensitively(tmp_path):
+    rules = comparison.load_rules(write_rules(tmp_path, {"statuses": {"failed": ["Failed", "BLOCKED"]}}))
+
+    assert labels([("P1", "failed", ""), ("P1", "Blocked", ""), ("P1", "PASSED", ""), ("P1", "Untested", "")],
+                  rules) == ["failed", "failed", "passed", "other"]
+
+
+def test_minor_keywords_match_at_the_start_of_a_word():
+    assert labels([("P1", "Failed", "Minor glitch"), ("P1", "Failed", "bypassed"), ("P1", "Failed", "unminor"),
+                   ("P1", "Passed", "minor")]) == ["failed_minor", "failed_minor", "failed", "passed_minor"]
+
+
+def test_plan_rules_override_statuses_and_keywords(tmp_path):
+    rules = comparison.load_rules(write_rules(tmp_path, {
+        "plans": {
+            "Smoke": {"statuses": {"failed": ["failed", "retest"]}},
+            "Nightly": {"minor_keywords": ["flaky"]}
+        }
+    }))
+    rows = [("Smoke", "Retest", ""), ("Smoke", "Passed", ""), ("Other", "Retest", ""),
+            ("Nightly", "Failed", "flaky test"), ("Nightly", "Failed", "minor"), ("Other", "Failed", "minor")]
+
+    assert labels(rows, rules) == ["failed", "passed", "other", "failed_minor", "failed", "failed_minor"]
+
+
+@pytest.mark.parametrize("rules", [
+    {"statuses": {"broken": ["failed"]}},
+    {"plans": {"Smoke": {"statuses": {"skipped": ["skipped"]}}}},
+])
+def test_unknown_status_class_is_an_error(tmp_path, rules):
+    with pytest.raises(ValueError, match="Unknown status class"):
+        comparison.load_rules(write_rules(tmp_path, rules))
+
+
+def test_rules_are_part_of_the_cache_keys(tmp_path):
+    default_key = comparison.rules_key(comparison.DEFAULT_RULES)
+    custom_key = comparison.rules_key(comparison.load_rules(write_rules(tmp_path, {"minor_keywords": ["minor"]})))
+
+    assert comparison.rules_key(comparison.load_rules()) == default_key
+    assert custom_key != default_key
+    assert cache.result_key(["digest"], ["A"], default_key) != cache.result_key(["digest"], ["A"], custom_key)
+
+    data = (HEADER + "T1,Title,C1,,P1,Passed,tester\n").encode("utf-8")
+    assert comparison.read_classified_csv(data)["rules"] == default_key
+    assert comparison.read_classified_csv(data, rules=comparison.load_rules(
+        write_rules(tmp_path, {"minor_keywords": ["minor"]})))["rules"] == custom_key
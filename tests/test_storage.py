@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def folders(tmp_path):
+    result_folder = tmp_path / "results"
+    upload_folder = tmp_path / "uploads"
+    result_folder.mkdir()
+    upload_folder.mkdir()
+    return str(result_folder), str(upload_folder), str(tmp_path / "cache" / "artifacts.json")
+
+
+def manager(folders, max_bytes=0, ttl_seconds=7 * DAY):
+    return storage.StorageManager(*folders, max_bytes, ttl_seconds)
+
+
+def write_file(path, size, age=0):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return os.path.abspath(path)
+
+
+def write_upload(folders, name, size=100, age=0):
+    return write_file(os.path.join(folders[1], name), size, age)
+
+
+def write_result(folders, stem, sources, size=100, age=0):
+    """
+    A stored comparison: manifest, tables and a workbook, registered with its uploads.
+    """
+    store = manager(folders)
+    store.register(stem, sources)
+    manifest_path = os.path.join(folders[0], stem + ".json")
+    with open(manifest_path, "w") as f:
+        json.dump({"source_files": sources}, f)
+    used = time.time() - age
+    os.utime(manifest_path, (used, used))
+    write_file(os.path.join(folders[0], stem + ".arrow"), size, age)
+    write_file(os.path.join(folders[0], stem + ".xlsx"), size, age)
+    set_registered(folders, stem, used)
+
+
+def set_registered(folders, stem, registered):
+    with open(folders[2]) as f:
+        index = json.load(f)
+    index["comparisons"][stem]["registered"] = registered
+    with open(folders[2], "w") as f:
+        json.dump(index, f)
+
+
+def result_files(folders):
+    return sorted(os.listdir(folders[0]))
+
+
+def upload_files(folders):
+    return sorted(os.listdir(folders[1]))
+
+
+def test_shared_upload_is_removed_with_the_last_comparison(folders):
+    shared = write_upload(folders, "shared.csv")
+    own = write_upload(folders, "own.csv")
+    write_result(folders, "old", [shared, own], age=10 * DAY)
+    write_result(folders, "new", [shared], age=DAY)
+
+    manager(folders).sweep()
+    assert result_files(folders) == ["new.arrow", "new.json", "new.xlsx"]
+    assert upload_files(folders) == ["shared.csv"]
+
+    manager(folders, ttl_seconds=DAY // 2).sweep()
+    assert result_files(folders) == []
+    assert upload_files(folders) == []
+
+
+def test_manifest_is_removed_first(folders, monkeypatch):
+    write_result(folders, "old", [], age=10 * DAY)
+    write_file(os.path.join(folders[0], "old.results.abc.html.gz"), 10, 10 * DAY)
+    removed = []
+    remove = os.remove
+    monkeypatch.setattr(os, "remove", lambda path: removed.append(os.path.basename(path)) or remove(path))
+
+    manager(folders).sweep()
+    assert removed[0] == "old.json"
+    assert sorted(removed) == ["old.arrow", "old.json", "old.results.abc.html.gz", "old.xlsx"]
+
+
+def test_kept_comparison_is_not_evicted(folders):
+    upload = write_upload(folders, "a.csv")
+    write_result(folders, "old", [upload], size=1000, age=10 * DAY)
+
+    result = manager(folders, max_bytes=10).sweep(keep={"old"})
+    assert result["evicted"] == 0
+    assert result_files(folders) == ["old.arrow", "old.json", "old.xlsx"]
+    assert upload_files(folders) == ["a.csv"]
+
+
+def test_orphan_uploads_are_removed_after_the_grace_period(folders):
+    write_upload(folders, "recent.csv", age=storage.ORPHAN_GRACE_SECONDS - 60)
+    write_upload(folders, "stale.csv", age=storage.ORPHAN_GRACE_SECONDS + 60)
+
+    assert manager(folders).sweep()["removed_uploads"] == 1
+    assert upload_files(folders) == ["recent.csv"]
+
+
+def test_expired_comparisons_go_before_least_recently_used(folders):
+    write_result(folders, "expired", [], size=10, age=10 * DAY)
+    write_result(folders, "older", [], size=1000, age=3 * DAY)
+    write_result(folders, "newer", [], size=1000, age=DAY)
+
+    # Without a size limit only the expired comparison goes
+    manager(folders).sweep()
+    assert result_files(folders) == ["newer.arrow", "newer.json", "newer.xlsx",
+                                     "older.arrow", "older.json", "older.xlsx"]
+
+    # Over the size limit the least recently used one goes next, until the rest fits
+    result = manager(folders, max_bytes=2500).sweep()
+    assert result["evicted"] == 1
+    assert result_files(folders) == ["newer.arrow", "newer.json", "newer.xlsx"]
+
+
+def test_touch_counts_as_use(folders):
+    write_result(folders, "used", [], age=10 * DAY)
+    write_result(folders, "unused", [], age=10 * DAY)
+
+    store = manager(folders)
+    store.touch("used")
+    store.sweep()
+    assert result_files(folders) == ["used.arrow", "used.json", "used.xlsx"]
+
+
+def test_in_progress_comparison_keeps_its_uploads_until_abandoned(folders):
+    upload = write_upload(folders, "a.csv", age=storage.ORPHAN_GRACE_SECONDS + 60)
+    store = manager(folders, max_bytes=10)
+    store.register("running", [upload])
+
+    store.sweep()
+    assert upload_files(folders) == ["a.csv"]
+
+    set_registered(folders, "running", time.time() - storage.IN_PROGRESS_SECONDS - 60)
+    assert store.sweep()["evicted"] == 1
+    assert upload_files(folders) == []
+
+
+def test_unregistered_failed_comparison_leaves_orphans(folders):
+    upload = write_upload(folders, "a.csv", age=storage.ORPHAN_GRACE_SECONDS + 60)
+    store = manager(folders)
+    store.register("failed", [upload])
+    store.unregister("failed")
+
+    assert store.sweep()["removed_uploads"] == 1
+    assert upload_files(folders) == []
@@ -0,0 +1,164 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import uuid
+
+# Folder of the uploads folder where requests spool large files, one subfolder per request
+INCOMING_FOLDER = "incoming"
+
+
+def request_folder(upload_folder):
+    """
+    Return a new folder path for the files of one request. The folder is only created once
+    a file is spooled to it, so requests with small files never touch the disk.
+    """
+    return os.path.join(upload_folder, INCOMING_FOLDER, uuid.uuid4().hex)
+
+
+class HashingFile:
+    """
+    File an upload is received into (see upload_stream): computes the SHA-256 digest and size
+    of everything written to it. Reading, seeking and closing go to the underlying file.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def upload_stream(total_content_length, spool_folder, memory_max_bytes):
+    """
+    File for one uploaded file of a request, as the multipart parser asks for it: the files
+    of requests up to memory_max_bytes are received in memory, those of larger requests are
+    written to a file of spool_folder as they arrive. Either way they are hashed on the way,
+    so read_upload does not read them again.
+
+    Parameters:
+    - total_content_length: Size of the whole request body (None if unknown)
+    - spool_folder: Folder of the request (see request_folder)
+    - memory_max_bytes: Largest request whose files are kept in memory
+    """
+    if total_content_length is not None and total_content_length <= memory_max_bytes:
+        return HashingFile(io.BytesIO())
+    os.makedirs(spool_folder, exist_ok=True)
+    return HashingFile(tempfile.NamedTemporaryFile(dir=spool_folder, suffix='.csv', delete=False))
+
+
+def read_upload(stream, filename, spool_folder, memory_max_bytes, chunk_size=1024 * 1024):
+    """
+    Describe an uploaded file. A file received through upload_stream was hashed and placed
+    (in memory or in a file of its request folder) while the request was read, so it is not
+    read again. Any other stream is read once, computing its SHA-256 digest on the way: up to
+    memory_max_bytes are kept in memory, larger files are spooled to a file of spool_folder.
+
+    Parameters:
+    - stream: Readable binary stream of the upload (e.g. FileStorage.stream)
+    - filename: Name the file was uploaded as
+    - spool_folder: Folder of the request (see request_folder)
+    - memory_max_bytes: Largest file kept in memory
+
+    Returns:
+    - Dictionary with the "filename", "digest", "size", and either the "data" (bytes) or the
+      "path" of the spooled file; see upload_source
+    """
+    if isinstance(stream, HashingFile):
+        in_memory = isinstance(stream.file, io.BytesIO)
+        if not in_memory:
+            stream.file.flush()
+        return {
+            "filename": filename,
+            "digest": stream.sha256.hexdigest(),
+            "size": stream.size,
+            "data": stream.file.getvalue() if in_memory else None,
+            "path": None if in_memory else stream.file.name
+        }
+
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    spool = None
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+            if spool is None and size > memory_max_bytes:
+                os.makedirs(spool_folder, exist_ok=True)
+                spool = tempfile.NamedTemporaryFile(dir=spool_folder, suffix='.csv', delete=False)
+                spool.writelines(chunks)
+                chunks = []
+            if spool is not None:
+                spool.write(chunk)
+            else:
+                chunks.append(chunk)
+    finally:
+        if spool is not None:
+            spool.close()
+
+    return {
+        "filename": filename,
+        "digest": digest.hexdigest(),
+        "size": size,
+        "data": None if spool is not None else b''.join(chunks),
+        "path": spool.name if spool is not None else None
+    }
+
+
+def keep_upload(upload, upload_folder):
+    """
+    Store the raw file of an upload in the uploads folder under its digest, so identical
+    files are stored once and files uploaded with the same name never overwrite each other.
+    A spooled file is moved there; a file in memory stays readable from memory.
+
+    Returns:
+    - Path of the stored file
+    """
+    path = os.path.join(upload_folder, upload["digest"] + '.csv')
+    if os.path.exists(path):
+        # Refresh it for the orphan grace period of the storage manager
+        os.utime(path)
+        if upload["data"] is None:
+            os.remove(upload["path"])
+    elif upload["data"] is None:
+        os.replace(upload["path"], path)
+    else:
+        temp_path = os.path.join(upload_folder, f"{upload['digest']}.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(upload["data"])
+        os.replace(temp_path, path)
+
+    if upload["data"] is None:
+        upload["path"] = path
+    return path
+
+
+def upload_source(upload):
+    """
+    What to parse for an upload: its contents in memory, or the path of its file.
+    """
+    return upload["data"] if upload["data"] is not None else upload["path"]
+
+
+def source_size(source):
+    """
+    Size in bytes of a CSV source: a file path, or the contents as bytes.
+    """
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def discard_request_folder(spool_folder):
+    """
+    Remove the spooled files of a request, if it spooled any.
+    """
+    if spool_folder:
+        shutil.rmtree(spool_folder, ignore_errors=True)
@@ -0,0 +1,143 @@
+import os
+
+import pandas as pd
+import xlsxwriter
+
+import cache
+import result_store
+
+# Sheet groups of a result workbook, in the order they are written:
+# - raw: All_Data_<file>, every column of the uploaded CSV files
+# - all: All_Failed_<file>, All_Passed_<file> and All_Minor_<file>
+# - comparisons: <Category>_in_<comparison>
+# - matrix: Comparison_Matrix
+SHEET_GROUPS = ["raw", "all", "comparisons", "matrix"]
+
+
+def excel_sheet_name(sheet_name):
+    """Truncate a sheet name to the 31 character limit of Excel"""
+    if len(sheet_name) > 31:
+        sheet_name = sheet_name[:28] + "..."
+    return sheet_name
+
+
+def unique_sheet_name(sheet_name, used):
+    """
+    Truncate a sheet name like excel_sheet_name, numbering it when the truncated name is
+    already taken (Excel compares sheet names case-insensitively).
+
+    Parameters:
+    - sheet_name: Full sheet name
+    - used: Set of the lower case names already in the workbook; the returned name is added
+    """
+    name = excel_sheet_name(sheet_name)
+    counter = 2
+    while name.lower() in used:
+        suffix = f"~{counter}"
+        name = sheet_name[:31 - len(suffix)] + suffix if len(sheet_name) + len(suffix) <= 31 \
+            else sheet_name[:28 - len(suffix)] + "..." + suffix
+        counter += 1
+    used.add(name.lower())
+    return name
+
+
+def write_sheet(workbook, header_format, sheet_name, header, rows):
+    """
+    Write a header and rows to a new sheet, one row at a time (required by constant memory mode).
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, header, header_format)
+    for row_index, row in enumerate(rows, start=1):
+        worksheet.write_row(row_index, 0, row)
+
+
+def iter_csv_rows(file_path, chunksize=None):
+    """
+    Yield the header and then every row of a CSV file, reading it chunk by chunk.
+    Missing values become None, numbers stay numbers.
+    """
+    reader = pd.read_csv(file_path, chunksize=chunksize or None)
+    chunks = [reader] if isinstance(reader, pd.DataFrame) else reader
+
+    header_sent = False
+    for chunk in chunks:
+        if not header_sent:
+            yield list(chunk.columns)
+            header_sent = True
+        values = chunk.astype(object).where(chunk.notna(), None)
+        yield from values.itertuples(index=False, name=None)
+
+
+def available_sources(manifest):
+    """
+    Source CSV files of a comparison whose contents are still the ones it was computed from,
+    in file order; None for the others.
+    """
+    digests = manifest.get("file_digests") or [None] * len(manifest["file_names"])
+    sources = []
+    for file_path, digest in zip(manifest.get("source_files") or [None] * len(digests), digests):
+        if file_path is None or not os.path.isfile(file_path):
+            sources.append(None)
+        elif digest is not None and cache.file_digest(file_path) != digest:
+            sources.append(None)
+        else:
+            sources.append(file_path)
+    return sources
+
+
+def write_result_workbook(output_path, manifest, tables_path, sheet_groups=None, chunksize=None):
+    """
+    Build the Excel workbook of a stored comparison result.
+
+    Sheets are streamed from the stored tables (and from the source CSV files for the raw
+    data sheets) with xlsxwriter's constant memory mode, so memory does not grow with the
+    size of the workbook. Raw data sheets are left out for source files that were not kept,
+    are gone, or no longer match the digest the comparison was computed from.
+
+    Parameters:
+    - output_path: Path of the workbook to write
+    - manifest: Result manifest (see result_store)
+    - tables_path: Path to the Arrow file with the result tables
+    - sheet_groups: Sheet groups to include (defaults to all of SHEET_GROUPS)
+    - chunksize: Number of rows read at a time from the source CSV files
+    """
+    sheet_groups = SHEET_GROUPS if sheet_groups is None else sheet_groups
+    tables = manifest.get("tables", {})
+
+    def table_rows(section, name):
+        return result_store.iter_table_rows(tables_path, tables[section][name]["batch"])
+
+    used_names = set()
+    workbook = xlsxwriter.Workbook(output_path, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    try:
+        if "raw" in sheet_groups:
+            for file_name, file_path in zip(manifest["file_names"], available_sources(manifest)):
+                if file_path is None:
+                    continue
+                rows = iter_csv_rows(file_path, chunksize)
+                header = next(rows, [])
+                sheet_name = unique_sheet_name(f"All_Data_{file_name}", used_names)
+                write_sheet(workbook, header_format, sheet_name, header, rows)
+
+        if "all" in sheet_groups:
+            for file_name in manifest["file_names"]:
+                for category in ("failed", "passed", "minor"):
+                    columns, rows = table_rows("all_data", f"all_{category}_{file_name}")
+                    sheet_name = unique_sheet_name(f"All_{category.capitalize()}_{file_name}", used_names)
+                    write_sheet(workbook, header_format, sheet_name, columns, rows)
+
+        if "comparisons" in sheet_groups:
+            for category in ("failed", "passed", "minor"):
+                for name in tables.get(f"{category}_comparisons", {}):
+                    columns, rows = table_rows(f"{category}_comparisons", name)
+                    sheet_name = unique_sheet_name(f"{category.capitalize()}_in_{name}", used_names)
+                    write_sheet(workbook, header_format, sheet_name, columns, rows)
+
+        if "matrix" in sheet_groups:
+            matrix = manifest.get("matrix") or []
+            header = list(matrix[0].keys()) if matrix else []
+            write_sheet(workbook, header_format, unique_sheet_name("Comparison_Matrix", used_names), header,
+                        ([item[col] for col in header] for item in matrix))
+    finally:
+        workbook.close()